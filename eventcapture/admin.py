@@ -1,10 +1,14 @@
 import pytz
 from datetime import datetime
 from django import forms
+from django.conf import settings
+from django.db import transaction
 from django.http import HttpResponseRedirect
+from django.urls import path
 from django.contrib import admin
 from django.shortcuts import render
-from .models import Cruise, Device, Event, ShipLog, CastReport, WireReport, Wire, Config, GPS
+from . import metrics, utils
+from .models import archive_cruise, Cruise, Device, Event, ShipLog, CastReport, WireReport, Wire, Config, GPS
 
 admin.site.site_header = 'ShipLog Admin Site'
 admin.site.index_title = 'ShipLog administration'
@@ -64,7 +68,7 @@ class CastReportAdmin(admin.ModelAdmin):
     list_filter = (CastReportCruiseListFilter, )
 
     def get_form(self, request, obj=None, **kwargs):
-        self.readonly_fields = ['cast', 'max_tension', 'max_payout', 'max_speed']
+        self.readonly_fields = ['cast', 'max_tension', 'max_payout', 'max_speed', 'mean_tension', 'duration']
         return super().get_form(request, obj, **kwargs)
 
     def changelist_view(self, request, extra_context=None):
@@ -77,11 +81,42 @@ class ShipLogForm(forms.ModelForm):
         model = ShipLog
         exclude = []
 
+class ShipLogImportForm(forms.Form):
+    cruise = forms.ModelChoiceField(queryset=Cruise.objects)
+    file = forms.FileField(help_text='CSV with timestamp (UTC), device and event columns, one event per row')
+
 class ShipLogAdmin(admin.ModelAdmin):
     form = ShipLogForm
     list_display = ('timestamp', 'event', 'device', 'cruise', )
     list_filter = (ShipLogCruiseListFilter, )
 
+    def get_urls(self):
+        urls = [path('import/', self.admin_site.admin_view(self.import_view), name='eventcapture_shiplog_import')]
+        return urls + super().get_urls()
+
+    def import_view(self, request):
+        context = dict(self.admin_site.each_context(request))
+        context['title'] = 'Import events'
+        context['opts'] = self.model._meta
+        if request.method != 'POST':
+            context['form'] = ShipLogImportForm(initial={'cruise': Cruise.get_active_cruise()})
+            return render(request, 'admin/eventcapture/shiplog/import.html', context)
+        form = ShipLogImportForm(request.POST, request.FILES)
+        context['form'] = form
+        if not form.is_valid():
+            return render(request, 'admin/eventcapture/shiplog/import.html', context)
+        try:
+            df = utils.read_import(form.cleaned_data['file'])
+        except ValueError as e:
+            context['errors'] = ['Unreadable import: {}'.format(e)]
+            return render(request, 'admin/eventcapture/shiplog/import.html', context)
+        result = ShipLog.import_events(form.cleaned_data['cruise'], df)
+        if result.errors:
+            context['errors'] = result.errors
+            return render(request, 'admin/eventcapture/shiplog/import.html', context)
+        self.message_user(request, 'Imported {} events, skipped {} already logged'.format(len(result.shiplogs), result.duplicates))
+        return HttpResponseRedirect('../')
+
     def get_form(self, request, obj=None, **kwargs):
         # shiplog entries are read only by default
         self.readonly_fields = ['cruise', 'device', 'event', 'gps', 'timestamp']
@@ -128,7 +163,14 @@ class CruiseAdmin(admin.ModelAdmin):
         if "end_cruise" in request.POST:
             obj.end_date = datetime.now(pytz.utc)
             obj.save()
-            self.message_user(request, "This cruise is now over")
+            if settings.ARCHIVE_CRUISES:
+                if settings.ASYNC:
+                    transaction.on_commit(lambda: archive_cruise.delay(obj.id))
+                else:
+                    archive_cruise(obj.id)
+                self.message_user(request, "This cruise is now over and is being archived")
+            else:
+                self.message_user(request, "This cruise is now over")
             return HttpResponseRedirect(".")
         return super().response_change(request, obj)
 
@@ -145,6 +187,8 @@ class WireReportAdmin(admin.ModelAdmin):
             context = {}
             context['cast_reports'] = obj.run_wire_report()
             context['wire'] = obj.wire
+            context['filename'] = obj.get_filename()
+            context['usage'] = obj.get_usage()
             context['start_date'] = obj.start_date
             context['end_date'] = obj.end_date
             return render(request, 'admin/wirereport.html', context)
@@ -174,6 +218,12 @@ class ConfigAdmin(admin.ModelAdmin):
             self.readonly_fields = []
         return super().get_form(request, obj, **kwargs)
 
+def performance_view(request):
+    context = dict(admin.site.each_context(request))
+    context['title'] = 'Performance'
+    context['rows'] = metrics.summarize(metrics.get_samples())
+    return render(request, 'admin/performance.html', context)
+
 admin.site.register(Device)
 admin.site.register(Event)
 admin.site.register(Cruise, CruiseAdmin)
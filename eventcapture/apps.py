@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class EventcaptureConfig(AppConfig):
     name = 'eventcapture'
+
+    def ready(self):
+        if settings.ARCHIVE_CRUISES:
+            from eventcapture import archive
+            archive.get_pyarrow()  # fail at startup rather than when the first cruise ends
@@ -0,0 +1,93 @@
+import os
+import json
+import shutil
+import tempfile
+from datetime import datetime
+from django.conf import settings
+from eventcapture.formats import get_pyarrow
+
+MANIFEST = 'manifest.json'
+VERSION = 2  # 2 added decimal degrees to the eventlog
+
+def get_path(cruise_id):
+    return os.path.join(settings.ARCHIVE_PATH, str(cruise_id))
+
+def get_manifest(cruise_id):
+    """The manifest of a cruise snapshot, None if the cruise was never archived"""
+    try:
+        with open(os.path.join(get_path(cruise_id), MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def read(cruise_id, name, columns=None):
+    """A table of a cruise snapshot as a DataFrame"""
+    pa, pq = get_pyarrow()
+    manifest = get_manifest(cruise_id)
+    if manifest is None or name not in manifest['tables']:
+        raise LookupError('Cruise {} has no archived {} table'.format(cruise_id, name))
+    return pq.read_table(os.path.join(get_path(cruise_id), manifest['tables'][name]['file']), columns=columns).to_pandas()
+
+class Snapshot(object):
+    """Compressed Parquet tables of a cruise, written to a scratch directory and moved into place with their manifest on close"""
+
+    def __init__(self, cruise_id, **info):
+        self.pa, self.pq = get_pyarrow()
+        self.cruise_id = cruise_id
+        self.info = info
+        self.tables = {}
+        self.writers = {}
+        os.makedirs(settings.ARCHIVE_PATH, exist_ok=True)
+        self.directory = tempfile.mkdtemp(dir=settings.ARCHIVE_PATH, prefix='.{}_'.format(cruise_id))
+
+    def write(self, name, df):
+        """A whole table at once"""
+        self.append(name, df)
+        self._close_writer(name)
+
+    def append(self, name, df):
+        """One chunk of a table streamed to disk, the first chunk sets its schema"""
+        table = self.pa.Table.from_pandas(df, preserve_index=False)
+        writer = self.writers.get(name)
+        if writer is None:
+            path = os.path.join(self.directory, name + '.parquet')
+            writer = self.writers[name] = self.pq.ParquetWriter(path, table.schema, compression=settings.ARCHIVE_COMPRESSION)
+            self.tables[name] = {'file': name + '.parquet', 'rows': 0}
+        else:
+            table = table.cast(writer.schema)
+        writer.write_table(table)
+        self.tables[name]['rows'] += len(df)
+
+    def _close_writer(self, name):
+        self.writers.pop(name).close()
+        self.tables[name]['bytes'] = os.path.getsize(os.path.join(self.directory, self.tables[name]['file']))
+
+    def close(self):
+        for name in list(self.writers):
+            self._close_writer(name)
+        manifest = {
+            'version': VERSION,
+            'cruise': self.cruise_id,
+            'created': datetime.utcnow().isoformat() + 'Z',
+            'compression': settings.ARCHIVE_COMPRESSION,
+            'tables': self.tables,
+        }
+        manifest.update(self.info)
+        with open(os.path.join(self.directory, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2, default=str)
+        # replace an older snapshot of the same cruise in one step
+        path = get_path(self.cruise_id)
+        stale = None
+        if os.path.exists(path):
+            stale = tempfile.mkdtemp(dir=settings.ARCHIVE_PATH, prefix='.stale_')
+            os.rename(path, os.path.join(stale, 'snapshot'))
+        os.rename(self.directory, path)
+        if stale:
+            shutil.rmtree(stale)
+        return manifest
+
+    def abort(self):
+        for writer in self.writers.values():
+            writer.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
@@ -0,0 +1,199 @@
+"""
+Benchmarks of the capture and reporting hot paths on a synthetic cruise, run with
+
+    python manage.py test eventcapture.benchmarks
+
+Each benchmark prints its wall time, query count and peak Python memory. The
+size of the cruise can be changed with BENCHMARK_DAYS and BENCHMARK_CASTS_PER_DAY.
+"""
+import os
+import time
+import pytz
+import shutil
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from eventcapture import nav, winch
+from eventcapture.models import Cruise, Device, Event, ShipLog, Cast, CastReport, WireReport, Wire, Config, GPS, analyze_cast
+
+DAYS = int(os.environ.get('BENCHMARK_DAYS', 14))
+CASTS_PER_DAY = int(os.environ.get('BENCHMARK_CASTS_PER_DAY', 48))
+CAST_LENGTH = timedelta(minutes=20)
+NAV_INTERVAL = 10  # seconds between fixes in the nav file
+START = datetime(2018, 7, 1, tzinfo=pytz.utc)
+FIXTURE_PATH = os.path.join(tempfile.gettempdir(), 'shiplog-benchmarks')
+
+def write_nav_file(path, start, days):
+    """A Campbell TOA5 file with the header layout of MainMetMast_Nav.dat and a ship steaming north east"""
+    times = pd.date_range(start, start + timedelta(days=days), freq='{}S'.format(NAV_INTERVAL), inclusive='left')
+    latitude = 21.3 + np.arange(len(times)) * 1e-4
+    longitude = -157.9 + np.arange(len(times)) * 1e-4
+    df = pd.DataFrame({
+        'TIMESTAMP': times.strftime('%Y-%m-%d %H:%M:%S'),
+        'RECORD': np.arange(len(times)),
+        'Lat_deg': latitude.astype(int),
+        'Lat_min': np.round((latitude % 1) * 60, 4),
+        'Lon_deg': np.trunc(longitude).astype(int),
+        'Lon_min': np.round((-longitude % 1) * 60, 4),
+    })
+    with open(path, 'w') as f:
+        f.write('"TOA5","MainMetMast","CR1000","1234","CR1000.Std.32","CPU:MainMetMast.CR1","1234","Nav"\n')
+        f.write('"TIMESTAMP","RECORD","Lat_deg","Lat_min","Lon_deg","Lon_min"\n')
+        f.write('"TS","RN","degrees","minutes","degrees","minutes"\n')
+        f.write('"","","Smp","Smp","Smp","Smp"\n')
+        df.to_csv(f, header=False, index=False)
+
+def write_winch_file(directory, day):
+    """A day of 1 Hz WinchDAC samples for all three winches"""
+    times = pd.date_range(day, day + timedelta(days=1), freq='S', inclusive='left')
+    seconds = np.arange(len(times))
+    df = pd.DataFrame({'Seconds': seconds, 'Date': times.strftime(winch.CLOCK_FORMAT)})
+    for winch_number in winch.WINCHES:
+        phase = seconds / 1200.0 * np.pi + winch_number
+        tension, speed, payout = winch.winch_columns(winch_number)
+        df[tension] = np.round(1000 * winch_number + 500 * np.sin(phase) ** 2, 1)
+        df[speed] = np.round(60 * np.cos(phase), 1)
+        df[payout] = np.round(1500 * np.sin(phase) ** 2, 1)
+    path = os.path.join(directory, day.strftime(winch.FILENAME_FORMAT))
+    with open(path, 'w') as f:
+        f.write(''.join('LCI-90i metadata line {}\n'.format(i) for i in range(winch.HEADER_LINES - 2)))
+        f.write(','.join(winch.COLUMNS) + '\n')
+        f.write('s,clock,lbs,m/min,m,lbs,m/min,m,lbs,m/min,m\n')
+        df.to_csv(f, header=False, index=False)
+
+class Measurement(object):
+    """Wall time, queries and peak traced memory of a block of code"""
+
+    def __init__(self, label):
+        self.label = label
+
+    def __enter__(self):
+        self.queries = CaptureQueriesContext(connection)
+        self.queries.__enter__()
+        tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.perf_counter() - self.start
+        self.peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.queries.__exit__(*args)
+        print('{:<40} {:>9.3f} s {:>7} queries {:>9.1f} MiB peak'.format(self.label, self.seconds, len(self.queries), self.peak / 2 ** 20))
+
+@override_settings(
+    ASYNC=False,
+    GPS_FILENAME=os.path.join(FIXTURE_PATH, 'MainMetMast_Nav.dat'),
+    WINCH_DATAFILE_PATH=os.path.join(FIXTURE_PATH, 'winch', '*WinchDAC.csv'),
+    WINCH_CACHE_PATH=os.path.join(FIXTURE_PATH, 'cache'),
+    EXPORT_CACHE_PATH=os.path.join(FIXTURE_PATH, 'exports'),
+    ARCHIVE_PATH=os.path.join(FIXTURE_PATH, 'archive'),
+    MEDIA_ROOT=os.path.join(FIXTURE_PATH, 'media'),
+)
+class CruiseBenchmark(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        shutil.rmtree(FIXTURE_PATH, ignore_errors=True)
+        os.makedirs(os.path.join(FIXTURE_PATH, 'winch'))
+        os.makedirs(os.path.join(FIXTURE_PATH, 'media'))
+        write_nav_file(os.path.join(FIXTURE_PATH, 'MainMetMast_Nav.dat'), START, DAYS)
+        for day in range(DAYS):
+            write_winch_file(os.path.join(FIXTURE_PATH, 'winch'), START + timedelta(days=day))
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(FIXTURE_PATH, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.deploy = Event.objects.create(name='Deploy')
+        cls.recover = Event.objects.create(name='Recover')
+        cls.device = Device.objects.create(name='CTD')
+        cls.device.events.add(cls.deploy, cls.recover)
+        cls.wire = Wire.objects.create(name='CTD wire', serial_number='0.322-1')
+        cls.config = Config.objects.create(device=cls.device, wire=cls.wire, winch=2)
+        cls.cruise = Cruise.objects.create(name='Synthetic Cruise', number='SC01', start_date=START)
+        cls.cruise.config.add(cls.config)
+
+        casts = DAYS * CASTS_PER_DAY
+        interval = timedelta(days=1) / CASTS_PER_DAY
+        gps = GPS.get_empty()
+        shiplogs = []
+        for i in range(casts):
+            deployed = START + i * interval
+            shiplogs.append(ShipLog(cruise=cls.cruise, device=cls.device, event=cls.deploy, gps=gps, timestamp=deployed))
+            shiplogs.append(ShipLog(cruise=cls.cruise, device=cls.device, event=cls.recover, gps=gps, timestamp=deployed + CAST_LENGTH))
+        ShipLog.objects.bulk_create(shiplogs, batch_size=500)
+
+        # every cast but the first few has been analyzed already, those are left for the analyze_cast benchmark
+        deployments = ShipLog.objects.filter(event=cls.deploy).order_by('timestamp')
+        recoveries = ShipLog.objects.filter(event=cls.recover).order_by('timestamp')
+        cls.pending = list(recoveries.values_list('id', flat=True)[:10])
+        Cast.objects.bulk_create([
+            Cast(cruise=cls.cruise, deployment=deployment, recovery=recovery, config=cls.config)
+            for deployment, recovery in list(zip(deployments, recoveries))[len(cls.pending):]
+        ], batch_size=500)
+        CastReport.objects.bulk_create([CastReport(cast=cast) for cast in Cast.objects.all()], batch_size=500)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_capture_event(self):
+        events = [self.deploy, self.recover] * 10
+        with Measurement('capture {} events'.format(len(events))):
+            for event in events:
+                self.client.post('/', {'cruise': self.cruise.id, 'device': self.device.id, 'event': event.id})
+
+    def test_locate_events(self):
+        shiplogs = list(ShipLog.objects.select_related('gps').order_by('timestamp')[:100])
+        nav.get_reader()  # parse the nav file outside the measurement
+        with Measurement('locate {} events'.format(len(shiplogs))):
+            for shiplog in shiplogs:
+                shiplog.locate()
+
+    def test_analyze_cast(self):
+        with Measurement('analyze_cast, cold winch cache'):
+            analyze_cast(self.pending[0])
+        with Measurement('analyze_cast x{}, warm'.format(len(self.pending) - 1)):
+            for recovery_id in self.pending[1:]:
+                analyze_cast(recovery_id)
+
+    def test_eventlog_export(self):
+        with Measurement('ShipLog._to_df {} events'.format(ShipLog.objects.count())):
+            ShipLog._to_df(ShipLog.get_log(self.cruise))
+
+    def test_wirelog_export(self):
+        with Measurement('CastReport._to_df {} casts'.format(CastReport.objects.count())):
+            CastReport._to_df(CastReport.get_log(self.cruise))
+
+    def test_wire_report(self):
+        wire_report = WireReport(start_date=START.date(), end_date=(START + timedelta(days=DAYS)).date(), wire=self.wire)
+        with Measurement('WireReport.run_wire_report'):
+            wire_report.run_wire_report()
+
+    def test_page_renders(self):
+        cast_report = CastReport.objects.first()
+        pages = [
+            ('/', 'index'),
+            ('/eventlog/', 'event log page'),
+            ('/eventlog/data/?draw=1&start=0&length=100', 'event log table, first page'),
+            ('/wirelog/', 'wire log page'),
+            ('/wirelog/data/?draw=1&start=0&length=100', 'wire log table, first page'),
+            ('/download/eventlog/{}/'.format(self.cruise.id), 'event log download'),
+            ('/download/wirelog/{}/'.format(self.cruise.id), 'wire log download'),
+            ('/cast/{}/profile/?width=800'.format(cast_report.id), 'cast profile'),
+        ]
+        for url, label in pages:
+            with Measurement(label):
+                response = self.client.get(url)
+                b''.join(response.streaming_content if response.streaming else [response.content])
+            self.assertEqual(response.status_code, 200, url)
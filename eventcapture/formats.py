@@ -0,0 +1,97 @@
+import zlib
+from collections import OrderedDict
+from django.core.exceptions import ImproperlyConfigured
+
+# format: (content type, extension), csv is what the bridge opens, the others are for the shore side pipelines
+FORMATS = OrderedDict([
+    ('csv', ('text/csv', '.csv')),
+    ('csv.gz', ('application/gzip', '.csv.gz')),
+    ('parquet', ('application/vnd.apache.parquet', '.parquet')),
+    ('feather', ('application/vnd.apache.arrow.file', '.feather')),
+])
+COLUMNAR = ('parquet', 'feather')
+FORMAT_CHOICES = [(name, name) for name in FORMATS]
+
+def get_pyarrow():
+    """pyarrow is only needed for archival and the columnar formats, import it when asked for"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImproperlyConfigured('Parquet and Feather files need pyarrow, pip install pyarrow')
+    return pyarrow, pyarrow.parquet
+
+def get_content_type(fmt):
+    return FORMATS[fmt][0]
+
+def get_filename(filename, fmt):
+    """A CSV filename setting with the extension of fmt"""
+    if filename.endswith('.csv'):
+        filename = filename[:-len('.csv')]
+    return filename + FORMATS[fmt][1]
+
+def iter_gzip(chunks):
+    """Gzip a stream of CSV text as it goes"""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+class _Sink(object):
+    """A file the Arrow writers write to, emptied after every batch"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_columnar(frames, fmt, empty):
+    """Parquet or Feather bytes of typed frames, one row group or record batch per frame, empty sets the schema"""
+    pa, pq = get_pyarrow()
+    schema = pa.Schema.from_pandas(empty, preserve_index=False)
+    sink = _Sink()
+    f = pa.PythonFile(sink, mode='w')
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(f, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_file(f, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+    for df in frames:
+        writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()
+    yield sink.drain()
+
+def write(df, path, fmt):
+    """A whole typed frame to a file"""
+    with open(path, 'wb') as f:
+        if fmt == 'csv':
+            f.write(df.to_csv().encode())
+        elif fmt == 'csv.gz':
+            for data in iter_gzip([df.to_csv()]):
+                f.write(data)
+        else:
+            for data in iter_columnar([df], fmt, df.iloc[:0]):
+                f.write(data)
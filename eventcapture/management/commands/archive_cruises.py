@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from eventcapture.models import Cruise
+
+class Command(BaseCommand):
+    help = 'Snapshot ended cruises into ARCHIVE_PATH, the ones ended before archival was turned on are not archived otherwise'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cruise', help='Cruise number, every ended cruise not archived yet by default')
+
+    def handle(self, *args, **options):
+        if options['cruise']:
+            try:
+                cruises = [Cruise.objects.get(number=options['cruise'])]
+            except Cruise.DoesNotExist:
+                raise CommandError('Unknown cruise {}'.format(options['cruise']))
+        else:
+            cruises = [cruise for cruise in Cruise.objects.filter(archived__isnull=True, end_date__isnull=False) if cruise.has_cruise_ended()]
+        for cruise in cruises:
+            manifest = cruise.archive()
+            rows = ', '.join('{} {}'.format(table['rows'], name) for name, table in manifest['tables'].items())
+            self.stdout.write('Archived cruise {}: {}'.format(cruise.number, rows))
+        self.stdout.write(self.style.SUCCESS('Archived {} cruises'.format(len(cruises))))
@@ -0,0 +1,45 @@
+import pytz
+import pandas as pd
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from eventcapture import nav
+from eventcapture.models import Cruise, ShipLog, GPS
+
+EPOCH_END = datetime(1970, 1, 2, tzinfo=pytz.utc)  # the GPS timestamp defaults to 1970-01-01
+
+class Command(BaseCommand):
+    help = "Fill in the GPS fix of every event still at 0°0' or at the 1970 default timestamp from the live and archived nav files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cruise', help='Cruise number, every cruise by default')
+        parser.add_argument('--dry-run', action='store_true', help='Report how many events would be fixed without saving them')
+
+    def handle(self, *args, **options):
+        empty_fix = models.Q(gps__latitude_degree=0, gps__latitude_minute=0, gps__longitude_degree=0, gps__longitude_minute=0)
+        default_timestamp = models.Q(gps__timestamp__isnull=True) | models.Q(gps__timestamp__lt=EPOCH_END)
+        shiplogs = ShipLog.objects.filter(empty_fix | default_timestamp)
+        if options['cruise']:
+            try:
+                shiplogs = shiplogs.filter(cruise=Cruise.objects.get(number=options['cruise']))
+            except Cruise.DoesNotExist:
+                raise CommandError('Unknown cruise {}'.format(options['cruise']))
+        events = pd.DataFrame.from_records(shiplogs.values_list('id', 'timestamp'), columns=['id', 'timestamp'])
+        if events.empty:
+            self.stdout.write('Every event has a GPS fix')
+            return
+
+        fixes = nav.get_history().reset_index()
+        events['timestamp'] = pd.to_datetime(events['timestamp'], utc=True)
+        matched = pd.merge_asof(events.sort_values('timestamp'), fixes, left_on='timestamp', right_on='TIMESTAMP', direction='nearest', tolerance=nav.TOLERANCE)
+        matched = matched.dropna(subset=['TIMESTAMP', 'Lat_deg', 'Lat_min', 'Lon_deg', 'Lon_min'])
+        self.stdout.write('{} events without a fix, {} found in the nav files'.format(len(events), len(matched)))
+        if options['dry_run'] or matched.empty:
+            return
+
+        with transaction.atomic():
+            fix_ids = GPS.get_fix_ids(matched.drop_duplicates('TIMESTAMP').set_index('TIMESTAMP')[['Lat_deg', 'Lat_min', 'Lon_deg', 'Lon_min']])
+            now = datetime.now(pytz.utc)  # bulk updates skip auto_now, bump modified so cached exports are rebuilt
+            located = [ShipLog(id=shiplog_id, gps_id=fix_ids[fix], modified=now) for shiplog_id, fix in matched[['id', 'TIMESTAMP']].itertuples(index=False)]
+            ShipLog.objects.bulk_update(located, ['gps', 'modified'], batch_size=500)
+        self.stdout.write(self.style.SUCCESS('Backfilled {} events'.format(len(matched))))
@@ -0,0 +1,66 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from eventcapture.models import EMPTY_FIX_TIMESTAMP, GPS, ShipLog
+
+BATCH = 500
+
+class Command(BaseCommand):
+    help = (
+        'Point every event at one GPS row per timestamp and delete the other rows. Run it before migrating '
+        'to unique GPS timestamps, then run it again with --decimal-degrees once migrated'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report how many rows would be merged without changing them')
+        parser.add_argument('--decimal-degrees', action='store_true', help='Fill in latitude and longitude of the fixes stored before they existed')
+
+    def handle(self, *args, **options):
+        if options['decimal_degrees']:
+            self.set_decimal_degrees(options['dry_run'])
+        else:
+            self.merge(options['dry_run'])
+
+    def merge(self, dry_run):
+        # only the columns that predate the unique timestamp are read, the table may not have the others yet
+        canonical = {}
+        duplicates = defaultdict(list)
+        unlocated = []
+        rows = GPS.objects.values_list('id', 'timestamp', 'latitude_degree', 'latitude_minute', 'longitude_degree', 'longitude_minute').order_by('id')
+        for gps_id, timestamp, *position in rows.iterator():
+            if timestamp is None:
+                if not any(position):
+                    unlocated.append(gps_id)  # events without a fix share the empty row
+                continue  # a fix without a time has nothing to merge with
+            if timestamp in canonical:
+                duplicates[canonical[timestamp]].append(gps_id)
+            else:
+                canonical[timestamp] = gps_id
+        empty_id = canonical.get(EMPTY_FIX_TIMESTAMP)
+        if empty_id is None and unlocated:
+            empty_id = unlocated.pop(0)
+        if unlocated:
+            duplicates[empty_id].extend(unlocated)
+        merged = sum(len(ids) for ids in duplicates.values())
+        self.stdout.write('{} duplicate GPS rows of {} timestamps'.format(merged, len(duplicates)))
+        if dry_run:
+            return
+        with transaction.atomic():
+            for canonical_id, ids in duplicates.items():
+                for i in range(0, len(ids), BATCH):
+                    batch = ids[i:i + BATCH]
+                    ShipLog.objects.filter(gps_id__in=batch).update(gps_id=canonical_id)
+                    GPS.objects.filter(pk__in=batch)._raw_delete(GPS.objects.db)  # delete() would select the columns the migration adds
+            if empty_id is not None:
+                GPS.objects.filter(pk=empty_id).update(timestamp=EMPTY_FIX_TIMESTAMP)
+        self.stdout.write(self.style.SUCCESS('Merged {} GPS rows, now run makemigrations and migrate'.format(merged)))
+
+    def set_decimal_degrees(self, dry_run):
+        fixes = list(GPS.objects.filter(latitude__isnull=True, timestamp__gt=EMPTY_FIX_TIMESTAMP))
+        self.stdout.write('{} fixes without decimal degrees'.format(len(fixes)))
+        if dry_run:
+            return
+        for gps in fixes:
+            gps.set_decimal_degrees()
+        GPS.objects.bulk_update(fixes, ['latitude', 'longitude'], batch_size=BATCH)
+        self.stdout.write(self.style.SUCCESS('Filled in {} fixes'.format(len(fixes))))
@@ -0,0 +1,96 @@
+import time
+import pytz
+from datetime import date, datetime, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from eventcapture import winch
+from eventcapture.models import WinchRollup
+
+class Command(BaseCommand):
+    help = 'Tail the WinchDAC files into the winch rollups, meant to run under supervisor'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Also ingest the files from this date on (YYYY-MM-DD) when nothing has been ingested yet')
+        parser.add_argument('--interval', type=float, default=settings.WINCH_INGEST_INTERVAL, help='Seconds between polls')
+        parser.add_argument('--once', action='store_true', help='Ingest what is there and exit')
+
+    def handle(self, *args, **options):
+        try:
+            since = datetime.strptime(options['since'], '%Y-%m-%d').date() if options['since'] else None
+        except ValueError:
+            raise CommandError('Dates are YYYY-MM-DD')
+        self.offsets = {}  # path to the offset just past the last row ingested
+        self.last = {w: WinchRollup.last_timestamp(w) for w in winch.WINCHES}
+        self.since = since
+        self.pruned = None
+        while True:
+            self.poll()
+            self.prune()
+            if options['once']:
+                return
+            time.sleep(options['interval'])
+
+    def poll(self):
+        winch_files = winch.files_between(date.min, date.max)
+        if not winch_files:
+            return
+        if not self.offsets:
+            winch_files = self.files_to_catch_up(winch_files)
+        else:
+            # finish the files the logger has moved on from, then follow the current one
+            winch_files = [f for f in winch_files if f.path in self.offsets or f.is_current]
+        for winch_file in winch_files:
+            offset = self.offsets.get(winch_file.path)
+            if offset is None:
+                offset = self.start_offset(winch_file)
+            df, self.offsets[winch_file.path] = winch_file.read_from(offset)
+            self.ingest(df)
+            if not winch_file.is_current:
+                del self.offsets[winch_file.path]
+
+    def files_to_catch_up(self, winch_files):
+        last = [ts for ts in self.last.values() if ts is not None]
+        if last:
+            first_day = min(last).date()
+        elif self.since:
+            first_day = self.since
+        else:
+            return winch_files[-1:]
+        return [f for f in winch_files if f.date >= first_day] or winch_files[-1:]
+
+    def start_offset(self, winch_file):
+        """Seek through the time index to just before the oldest row any winch still needs"""
+        last = [ts for ts in self.last.values() if ts is not None]
+        if not last:
+            return 0
+        start = winch.naive_utc(min(last)).to_datetime64()
+        return winch_file.offsets_between(start, start)[0]
+
+    def ingest(self, df):
+        with transaction.atomic():
+            for winch_number in winch.WINCHES:
+                samples = df[['Date'] + winch.winch_columns(winch_number)]
+                samples.columns = ['Date'] + winch.CHANNELS
+                samples = samples.dropna(subset=winch.CHANNELS, how='all')
+                last = self.last[winch_number]
+                if last is not None:
+                    samples = samples[samples['Date'] > winch.naive_utc(last)]
+                if samples.empty:
+                    continue
+                WinchRollup.add(winch_number, samples)
+                self.last[winch_number] = pytz.utc.localize(samples['Date'].max().to_pydatetime())
+        if len(df):
+            self.stdout.write('Ingested {} rows up to {}'.format(len(df), df['Date'].max()))
+
+    def prune(self):
+        """Drop 1 s buckets past their retention once an hour, the 10 s and 1 min buckets are kept"""
+        now = datetime.now(pytz.utc)
+        if self.pruned is not None and now - self.pruned < timedelta(hours=1):
+            return
+        retention = timedelta(days=settings.WINCH_SAMPLE_RETENTION_DAYS)
+        for winch_number, last in self.last.items():
+            # counted back from the newest sample so the rows a restart resumes from are never pruned
+            if last is not None:
+                WinchRollup.objects.filter(winch=winch_number, resolution=1, timestamp__lt=last - retention).delete()
+        self.pruned = now
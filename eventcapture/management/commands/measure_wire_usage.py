@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from eventcapture.models import CastReport, Wire, WireUsage
+
+class Command(BaseCommand):
+    help = 'Measure the wire usage of casts analyzed before usage was accounted, or of every cast with --all'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wire', help='Wire serial number, every wire by default')
+        parser.add_argument('--all', action='store_true', help='Measure casts that already have their usage again')
+
+    def handle(self, *args, **options):
+        cast_reports = CastReport.objects.filter(cast__config__wire__isnull=False).select_related('cast__config', 'cast__deployment', 'cast__recovery')
+        if options['wire']:
+            try:
+                cast_reports = cast_reports.filter(cast__config__wire=Wire.objects.get(serial_number=options['wire']))
+            except Wire.DoesNotExist:
+                raise CommandError('Unknown wire {}'.format(options['wire']))
+        if not options['all']:
+            cast_reports = cast_reports.filter(cast__wire_usage__isnull=True)
+        measured = 0
+        for cast_report in cast_reports.order_by('cast__recovery__timestamp').iterator():
+            WireUsage.measure(cast_report)
+            measured += 1
+        self.stdout.write(self.style.SUCCESS('Measured the wire usage of {} casts'.format(measured)))
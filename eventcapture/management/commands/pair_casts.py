@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from eventcapture.models import Cruise, ShipLog, Cast
+
+class Command(BaseCommand):
+    help = 'Pair the deploy and recover events of a cruise, report orphans and double deployments and optionally save missing casts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('cruise', help='Cruise number')
+        parser.add_argument('--save', action='store_true', help='Save a cast for every pair that does not have one yet')
+
+    def handle(self, *args, **options):
+        try:
+            cruise = Cruise.objects.get(number=options['cruise'])
+        except Cruise.DoesNotExist:
+            raise CommandError('Unknown cruise {}'.format(options['cruise']))
+        pairing = ShipLog.pair_events(cruise)
+        for shiplog in pairing.orphan_recoveries:
+            self.stdout.write(self.style.WARNING('Recovered without a deployment: {}'.format(shiplog)))
+        for shiplog in pairing.double_deployments:
+            self.stdout.write(self.style.WARNING('Deployed again before being recovered: {}'.format(shiplog)))
+        for shiplog in pairing.orphan_deployments:
+            self.stdout.write('Not recovered yet: {}'.format(shiplog))
+
+        paired = set(Cast.get_log(cruise).values_list('deployment_id', 'recovery_id'))
+        missing = [(d, r) for d, r in pairing.pairs if (d.id, r.id) not in paired]
+        self.stdout.write('{} pairs, {} without a cast'.format(len(pairing.pairs), len(missing)))
+        if not options['save']:
+            return
+        for deployment, recovery in missing:
+            cast = Cast(deployment=deployment, recovery=recovery, config=recovery.find_config())
+            cast.save()
+            self.stdout.write('Saved {}'.format(cast))
@@ -0,0 +1,111 @@
+import os
+import time
+import pytz
+from datetime import datetime, timedelta
+from collections import defaultdict
+from multiprocessing import Pool
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, models
+from eventcapture import winch
+from eventcapture.models import archive_cruise, Cruise, CastReport, WireUsage
+
+def parse_file(winch_file):
+    """Parse a winch file once so every cast touching it reads the cache"""
+    winch_file.load()
+    return winch_file.path
+
+def analyze_casts(job):
+    """Recompute the reports and wire usage of all casts that touch the same winch files, loading each file once"""
+    winch_files, cast_reports = job
+    frames = [f.load() for f in winch_files]
+    analyzed = []
+    for cast_report in cast_reports:
+        deploy_time = cast_report.cast.deployment.timestamp
+        recover_time = cast_report.cast.recovery.timestamp
+        winch_number = cast_report.cast.config.winch
+        chunks = (chunk for df in frames for chunk in winch.iter_frame(df, deploy_time, recover_time, winch_number))
+        usage = WireUsage.get_stats() if cast_report.cast.config.wire_id else None
+        cast_report.set_cast_report(chunks, usage)
+        analyzed.append((cast_report, usage))
+    return analyzed
+
+class Command(BaseCommand):
+    help = 'Recompute the cast reports of a cruise, a date range or a wire from the winch files'
+    fields = ['max_tension', 'max_payout', 'max_speed', 'mean_tension', 'duration', 'modified']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cruise', help='Cruise number')
+        parser.add_argument('--start', help='Recovered on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Recovered on or before this date (YYYY-MM-DD)')
+        parser.add_argument('--wire', help='Wire serial number')
+        parser.add_argument('--processes', type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        cast_reports = self.get_cast_reports(options)
+        if not cast_reports:
+            raise CommandError('No casts on a winch match those options')
+        jobs = self.group_by_winch_files(cast_reports)
+        winch_files = {f.path: f for files, _ in jobs for f in files}
+        self.stdout.write('Recomputing {} casts touching {} winch files with {} processes'.format(len(cast_reports), len(winch_files), options['processes']))
+
+        # worker processes never touch the database, don't let them inherit its connections
+        connections.close_all()
+        started = time.time()
+        done = 0
+        with Pool(options['processes']) as pool:
+            for path in pool.imap_unordered(parse_file, winch_files.values()):
+                self.stdout.write('Parsed {}'.format(path))
+            parsed = time.time()
+            for analyzed in pool.imap_unordered(analyze_casts, jobs):
+                done += len(analyzed)
+                self.save(analyzed)
+                elapsed = time.time() - parsed
+                self.stdout.write('{}/{} casts, {:.1f} casts/s'.format(done, len(cast_reports), done / elapsed if elapsed else 0))
+        elapsed = time.time() - started
+        self.stdout.write(self.style.SUCCESS('Recomputed {} casts in {:.1f}s ({:.1f} casts/s, {:.1f} files/s)'.format(done, elapsed, done / elapsed, len(winch_files) / elapsed)))
+        if settings.ARCHIVE_CRUISES:
+            self.rearchive(cast_reports)
+
+    def get_cast_reports(self, options):
+        query = models.Q(cast__config__winch__gt=0)
+        if options['cruise']:
+            query &= models.Q(cast__cruise__number=options['cruise'])
+        if options['start']:
+            query &= models.Q(cast__recovery__timestamp__gte=pytz.utc.localize(datetime.strptime(options['start'], '%Y-%m-%d')))
+        if options['end']:
+            end_date = pytz.utc.localize(datetime.strptime(options['end'], '%Y-%m-%d')) + timedelta(days=1)  # through the end of the day
+            query &= models.Q(cast__recovery__timestamp__lt=end_date)
+        if options['wire']:
+            query &= models.Q(cast__config__wire__serial_number=options['wire'])
+        cast_reports = CastReport.objects.filter(query).select_related('cast__deployment', 'cast__recovery', 'cast__config')
+        return list(cast_reports.order_by('cast__recovery__timestamp'))
+
+    def group_by_winch_files(self, cast_reports):
+        all_files = winch.files_between(datetime.min.date(), datetime.max.date())
+        groups = defaultdict(list)
+        for cast_report in cast_reports:
+            deploy_date = cast_report.cast.deployment.timestamp.date()
+            recover_date = cast_report.cast.recovery.timestamp.date()
+            files = tuple(f for f in all_files if deploy_date <= f.date and f.date <= recover_date)
+            groups[files].append(cast_report)
+        return list(groups.items())
+
+    def rearchive(self, cast_reports):
+        """Snapshot the archived cruises again so the All exports pick up the new reports"""
+        cruises = Cruise.objects.filter(pk__in={cast_report.cast.cruise_id for cast_report in cast_reports}, archived__isnull=False)
+        for cruise in cruises:
+            if settings.ASYNC:
+                archive_cruise.delay(cruise.id)
+            else:
+                archive_cruise(cruise.id)
+            self.stdout.write('Archiving cruise {} again'.format(cruise.number))
+
+    def save(self, analyzed):
+        now = datetime.now(pytz.utc)
+        for cast_report, usage in analyzed:
+            cast_report.modified = now
+        CastReport.objects.bulk_update([cast_report for cast_report, usage in analyzed], self.fields)
+        for cast_report, usage in analyzed:
+            if usage is not None:
+                WireUsage.record(cast_report.cast, usage)
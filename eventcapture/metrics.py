@@ -0,0 +1,132 @@
+import os
+import time
+import socket
+import threading
+from collections import deque
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from celery import signals
+
+PROCESSES_KEY = 'eventcapture.metrics.processes'
+PROCESS_KEY = 'eventcapture.metrics.{}.{}'
+
+_samples = deque(maxlen=settings.METRICS_BUFFER_SIZE)  # (name, time, seconds, queries, query seconds)
+_lock = threading.Lock()
+_flushed = [0.0]
+
+def record(name, seconds, queries=0, query_seconds=0.0):
+    now = time.time()
+    with _lock:
+        _samples.append((name, now, seconds, queries, query_seconds))
+        due = now - _flushed[0] >= settings.METRICS_FLUSH_INTERVAL
+        if due:
+            _flushed[0] = now
+    if due:
+        flush()
+
+def flush():
+    """Share this process' buffer through the metrics cache so the dashboard sees the web and Celery processes alike"""
+    metrics = caches[settings.METRICS_CACHE]
+    key = PROCESS_KEY.format(socket.gethostname(), os.getpid())
+    with _lock:
+        samples = list(_samples)
+    metrics.set(key, samples, settings.METRICS_TIMEOUT)
+    processes = metrics.get(PROCESSES_KEY, [])
+    if key not in processes:
+        metrics.set(PROCESSES_KEY, processes + [key], None)
+
+def get_samples():
+    metrics = caches[settings.METRICS_CACHE]
+    processes = metrics.get(PROCESSES_KEY, [])
+    buffers = metrics.get_many(processes)
+    if len(buffers) < len(processes):
+        # forget the processes whose buffers expired
+        metrics.set(PROCESSES_KEY, [key for key in processes if key in buffers], None)
+    return [sample for samples in buffers.values() for sample in samples]
+
+def summarize(samples):
+    """Count, latency percentiles and SQL share of every name, slowest p90 first"""
+    by_name = {}
+    for name, timestamp, seconds, queries, query_seconds in samples:
+        by_name.setdefault(name, []).append((seconds, queries, query_seconds))
+    rows = []
+    for name, values in by_name.items():
+        seconds, queries, query_seconds = np.array(values).T
+        p50, p90, p99 = np.percentile(seconds, [50, 90, 99]) * 1000
+        rows.append({
+            'name': name,
+            'count': len(values),
+            'p50': p50,
+            'p90': p90,
+            'p99': p99,
+            'max': seconds.max() * 1000,
+            'queries': queries.mean(),
+            'query_ms': query_seconds.mean() * 1000,
+        })
+    return sorted(rows, key=lambda row: row['p90'], reverse=True)
+
+class span(object):
+    """Time a block of code and the SQL it runs, recorded under name"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self._wrapper = connection.execute_wrapper(self._count)
+        self._wrapper.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._start
+        self._wrapper.__exit__(*exc)
+        record(self.name, seconds, self.queries, self.query_seconds)
+
+    def _count(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - start
+
+class MetricsMiddleware(object):
+    """Record latency and SQL of every request under the name of the view that served it"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with span('view') as timer:
+            response = self.get_response(request)
+            match = request.resolver_match
+            timer.name = 'view:{}'.format(match.view_name if match else 'unresolved')
+        return response
+
+# Celery: time spent publishing, waiting in the broker and running each task
+_published = threading.local()
+
+@signals.before_task_publish.connect
+def _before_publish(sender=None, headers=None, **kwargs):
+    headers['published_at'] = time.time()
+    _published.start = time.perf_counter()
+
+@signals.after_task_publish.connect
+def _after_publish(sender=None, **kwargs):
+    start = getattr(_published, 'start', None)
+    if start is not None:
+        record('publish:{}'.format(sender), time.perf_counter() - start)
+
+@signals.task_prerun.connect
+def _task_prerun(task=None, **kwargs):
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at is not None:
+        record('queue:{}'.format(task.name), max(time.time() - published_at, 0.0))
+
+@signals.task_postrun.connect
+def _task_postrun(**kwargs):
+    flush()  # workers may sit idle for a long time after a task, share its spans now
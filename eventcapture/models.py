@@ -1,25 +1,86 @@
 from __future__ import absolute_import, unicode_literals
 import os
 import pytz
-import ntpath
-from shutil import copyfile
+from collections import namedtuple
 import numpy as np
 import pandas as pd
-from glob import glob
 from datetime import datetime, timedelta
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
-from celery import shared_task
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from celery import group, shared_task
+from celery.exceptions import MaxRetriesExceededError
+from eventcapture import archive, formats, metrics, nav, winch
+
+ACTIVE_CRUISE_KEY = 'eventcapture.active_cruise'
+DEVICE_TREE_KEY = 'eventcapture.device_tree'
+EMPTY_FIX_TIMESTAMP = datetime(1970, 1, 1, tzinfo=pytz.utc)
+CAST_PROFILE_KEY = 'eventcapture.cast_profile.{}.{}.{:%Y%m%d%H%M%S%f}'
+
+Pairing = namedtuple('Pairing', ['pairs', 'orphan_deployments', 'orphan_recoveries', 'double_deployments'])
+Import = namedtuple('Import', ['shiplogs', 'duplicates', 'errors'])
 
 @shared_task
-def analyze_cast(recovery_id):
-    recovery = ShipLog.objects.get(pk=int(recovery_id))
-    config = recovery.find_config()
-    deployment = recovery.find_deployment()
-    cast = Cast(deployment=deployment, recovery=recovery, config=config)
-    cast.save()
+def cleanup_gps():
+    # skip recent fixes, an event may be about to point at them
+    orphans = GPS.objects.filter(shiplog__isnull=True, timestamp__lt=datetime.now(pytz.utc) - timedelta(days=1)).exclude(timestamp=EMPTY_FIX_TIMESTAMP)
+    deleted, _ = orphans.delete()
+    return 'Deleted {} GPS fixes no event points at'.format(deleted)
+
+@shared_task
+def archive_cruise(cruise_id):
+    cruise = Cruise.objects.get(pk=int(cruise_id))
+    manifest = cruise.archive()
+    rows = sum(table['rows'] for table in manifest['tables'].values())
+    return 'Archived {} rows of cruise {}'.format(rows, cruise.number)
+
+@shared_task(bind=True, max_retries=settings.WINCH_ROLLUP_MAX_RETRIES, default_retry_delay=settings.WINCH_ROLLUP_RETRY_DELAY)
+def analyze_cast(self, recovery_id):
+    with metrics.span('analyze_cast'):
+        recovery = ShipLog.objects.get(pk=int(recovery_id))
+        config = recovery.find_config()
+        deployment = recovery.find_deployment()
+        if deployment is None:
+            return 'No deployment found for recovery with id of {}'.format(recovery.id)
+        if not self.request.called_directly and config is not None and WinchRollup.is_behind(config.winch, recovery.timestamp):
+            # the ingester has not rolled up the end of the cast yet, wait for it rather than parse the winch files
+            try:
+                raise self.retry()
+            except MaxRetriesExceededError:
+                pass
+        cast = Cast(deployment=deployment, recovery=recovery, config=config)
+        cast.save()
     return 'Saved cast with id of {}'.format(cast.id)
 
+@shared_task(bind=True, max_retries=settings.GPS_MAX_RETRIES, default_retry_delay=settings.GPS_RETRY_DELAY)
+def locate_event(self, shiplog_id):
+    shiplog = ShipLog.objects.select_related('gps').get(pk=int(shiplog_id))
+    if not shiplog.locate():
+        # the nav file has not caught up with the event yet
+        try:
+            raise self.retry()
+        except MaxRetriesExceededError:
+            return 'No GPS data for shiplog with id of {}, leaving it for the sweeper'.format(shiplog.id)
+    return 'Located shiplog with id of {}'.format(shiplog.id)
+
+@shared_task
+def sweep_gps():
+    fixes = nav.get_reader(settings.GPS_FILENAME).fixes
+    if fixes.empty:
+        return 'No GPS data'
+    empty_fix = models.Q(gps__latitude_degree=0, gps__latitude_minute=0, gps__longitude_degree=0, gps__longitude_minute=0)
+    in_nav_file = models.Q(timestamp__gte=fixes.index[0] - nav.TOLERANCE)
+    shiplogs = ShipLog.objects.filter(empty_fix & in_nav_file).select_related('gps')
+    for shiplog in shiplogs:
+        shiplog.locate()
+    return 'Looked up GPS data for {} shiplogs at 0°0\''.format(len(shiplogs))
+
+def get_decimal_degrees(degree, minute):
+    """Signed decimal degrees, the hemisphere is in the degree or, within a degree of the equator or meridian, the minute"""
+    sign = -1 if degree < 0 or minute < 0 else 1
+    return sign * (abs(float(degree)) + abs(float(minute)) / 60)
+
 def config_device_choices():
     devices = Device.objects.filter(events__isnull=False)
     return {'id__in': devices}
@@ -27,11 +88,6 @@ def config_device_choices():
 def get_default_cruise():
     return Cruise.get_active_cruise()
 
-def get_default_gps():
-    gps = GPS()
-    gps.save(timestamp=None)
-    return gps
-
 class Event(models.Model):
     name = models.CharField(
         max_length=25,
@@ -60,24 +116,55 @@ class Device(models.Model):
 
     def get_child_devices(self, cruise):
         """Get child devices for this cruise only"""
-        return [config.device for config in cruise.config.filter(device__parent_device=self.id)]
+        device_ids = cruise.get_device_ids()
+        tree = DeviceTree.load(device_ids)
+        return [tree.devices[device_id] for device_id in device_ids if tree.parents[device_id] == self.id]
 
     def get_lineage(self):
-        lineage = []
-        device = self
-        while True:
-            try:
-                device = device.parent_device
-            except AttributeError:
-                break
-            if device is None:
-                break
-            lineage.insert(0, device)
-        return lineage
+        return DeviceTree.load([self.id]).get_lineage(self.id)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        DeviceTree.clear()
+
+    def delete(self, *args, **kwargs):
+        super().delete(*args, **kwargs)
+        DeviceTree.clear()
 
     def __str__(self):
         return self.name
 
+class DeviceTree(object):
+    """Every device and its parent, loaded in one query and cached until a Device or Config changes"""
+
+    def __init__(self, devices):
+        self.devices = {device.id: device for device in devices}
+        self.parents = {device.id: device.parent_device_id for device in devices}
+
+    @classmethod
+    def load(cls, device_ids=()):
+        tree = cache.get(DEVICE_TREE_KEY)
+        if tree is None or not tree.devices.keys() >= set(device_ids):  # another process may have added a device
+            tree = cls(list(Device.objects.all()))
+            cache.set(DEVICE_TREE_KEY, tree, settings.DEVICE_TREE_TIMEOUT)
+        return tree
+
+    @classmethod
+    def clear(cls):
+        cache.delete(DEVICE_TREE_KEY)
+
+    def get_lineage(self, device_id):
+        lineage = []
+        parent_id = self.parents[device_id]
+        while parent_id is not None:
+            lineage.insert(0, self.devices[parent_id])
+            parent_id = self.parents[parent_id]
+        return lineage
+
+    def get_root(self, device_id):
+        lineage = self.get_lineage(device_id)
+        return lineage[0] if lineage else self.devices[device_id]
+
 class Wire(models.Model):
     name = models.CharField(max_length=30)
     serial_number = models.CharField(max_length=50, unique=True)
@@ -98,6 +185,14 @@ class Config(models.Model):
         help_text='The winch selection is only used if it is part of the LCI-90i Winch Monitoring System (aka winches 1, 2, and 3).  If the winch is not instrumented with a tensiometer or meter wheel, then skip the winch selection.'
     )
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        DeviceTree.clear()
+
+    def delete(self, *args, **kwargs):
+        super().delete(*args, **kwargs)
+        DeviceTree.clear()
+
     def __str__(self):
         winch = 'not on a winch'
         wire = 'not on a wire'
@@ -122,6 +217,7 @@ class Cruise(models.Model):
         Config,
         default=None,
     )
+    archived = models.DateTimeField(blank=True, null=True, editable=False, help_text='When the cruise was last snapshot into ARCHIVE_PATH')
 
     def __str__(self):
         ended = 'ENDED' if self.has_cruise_ended() else 'FUTURE' if self.has_cruise_started() else 'ACTIVE'
@@ -137,63 +233,137 @@ class Cruise(models.Model):
 
     @classmethod
     def get_active_cruise(cls):
+        cached = cache.get(ACTIVE_CRUISE_KEY)
+        if cached is not None:
+            return cached[0]
         right_now = datetime.now(pytz.utc)
         start_past = models.Q(start_date__lte=right_now)
         end_null = models.Q(end_date=None)
         end_future = models.Q(end_date__gte=right_now)
-        cruises = cls.objects.filter(start_past & (end_null | end_future))
+        cruises = list(cls.objects.filter(start_past & (end_null | end_future))[:2])
         if len(cruises) > 1:
             raise ValueError('Overlapping cruises not allowed')
-        return cruises.first()
+        cruise = cruises[0] if cruises else None
+
+        # the active cruise changes when it ends or the next one starts, don't cache it past either
+        expires = [right_now + timedelta(seconds=settings.ACTIVE_CRUISE_TIMEOUT)]
+        if cruise is not None and cruise.end_date is not None:
+            expires.append(cruise.end_date)
+        next_start = cls.objects.filter(start_date__gt=right_now).aggregate(models.Min('start_date'))['start_date__min']
+        if next_start is not None:
+            expires.append(next_start)
+        cache.set(ACTIVE_CRUISE_KEY, (cruise, ), int((min(expires) - right_now).total_seconds()))
+        return cruise
+
+    @classmethod
+    def clear_active_cruise(cls):
+        cache.delete(ACTIVE_CRUISE_KEY)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        Cruise.clear_active_cruise()
+
+    def delete(self, *args, **kwargs):
+        super().delete(*args, **kwargs)
+        Cruise.clear_active_cruise()
+
+    def archive(self):
+        """Snapshot the logs, tables and raw winch and nav data of this cruise into ARCHIVE_PATH, the live rows are kept"""
+        started = datetime.now(pytz.utc)  # rows changed while this runs make the snapshot stale
+        end_date = self.end_date or started
+        snapshot = archive.Snapshot(self.id, number=self.number, name=self.name, start_date=self.start_date, end_date=end_date)
+        try:
+            for name, cls in (('eventlog', ShipLog), ('wirelog', CastReport)):
+                log = cls.get_all_logs().filter(**{cls.cruise_field: self})  # the rows the All export leaves to this snapshot
+                snapshot.write(name, pd.DataFrame.from_records(log.values_list(*cls.export_fields), columns=cls.export_fields))
+            snapshot.write('shiplog', pd.DataFrame.from_records(ShipLog.objects.filter(cruise=self).values()))
+            snapshot.write('cast', pd.DataFrame.from_records(Cast.objects.filter(cruise=self).values()))
+            snapshot.write('castreport', pd.DataFrame.from_records(CastReport.objects.filter(cast__cruise=self).values()))
+            snapshot.write('gps', pd.DataFrame.from_records(GPS.objects.filter(shiplog__cruise=self).distinct().values()))
+            fixes = nav.get_history()
+            snapshot.write('nav', fixes.loc[self.start_date:end_date].reset_index())
+            start, end = winch.naive_utc(self.start_date), winch.naive_utc(end_date)
+            for winch_file in winch.files_between(start.date(), end.date()):
+                # a day at a time, a cruise of 1 Hz samples does not fit in memory
+                df = winch_file.load()
+                snapshot.append('winch', df[(df['Date'] >= start) & (df['Date'] <= end)])
+        except Exception:
+            snapshot.abort()
+            raise
+        manifest = snapshot.close()
+        Cruise.objects.filter(pk=self.pk).update(archived=started)
+        return manifest
+
+    def get_device_ids(self):
+        return list(self.config.values_list('device_id', flat=True))
 
     def get_parent_devices(self):
         """Unique list of highest-level parents devices"""
-        no_parents = [config.device for config in self.config.all().filter(device__parent_device__isnull=True)]
-        has_parent = self.config.all().filter(device__parent_device__isnull=False)
-        for config in has_parent:
-            parent = config.device.parent_device
-            while parent.parent_device is not None:
-                parent = parent.parent_device
+        device_ids = self.get_device_ids()
+        tree = DeviceTree.load(device_ids)
+        no_parents = [tree.devices[device_id] for device_id in device_ids if tree.parents[device_id] is None]
+        for device_id in device_ids:
+            parent = tree.get_root(device_id)
             if parent not in no_parents:
                 no_parents.append(parent)
         return no_parents
 
 class GPS(models.Model):
+    """A nav fix, stored once per nav timestamp and shared by every event logged near it"""
     latitude_degree = models.IntegerField(default=0)
     longitude_degree = models.IntegerField(default=0)
     latitude_minute = models.DecimalField(max_digits=8, decimal_places=4, default=0)
     longitude_minute = models.DecimalField(max_digits=8, decimal_places=4, default=0)
-    timestamp = models.DateTimeField(blank=True, null=True, default="1970-01-01 00:00:00")
+    timestamp = models.DateTimeField(blank=True, null=True, default=EMPTY_FIX_TIMESTAMP, unique=True)
+    latitude = models.FloatField(null=True, blank=True, editable=False, help_text='Signed decimal degrees, north is positive')
+    longitude = models.FloatField(null=True, blank=True, editable=False, help_text='Signed decimal degrees, east is positive')
 
-    def save(self, timestamp=None, *args, **kwargs):
-        df = self._read_gps_file()
-        try:
-            gps = self._get_gps_record(df, timestamp)
-            self.latitude_degree = gps['Lat_deg']
-            self.longitude_degree = gps['Lon_deg']
-            self.latitude_minute = gps['Lat_min']
-            self.longitude_minute = gps['Lon_min']
-            self.timestamp = gps.name
-        except TypeError:
-            pass
-        super().save(*args, **kwargs)
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude']),  # position range filters
+        ]
 
-    def _read_gps_file(self):
-        dtype = {'TIMESTAMP':str, 'Lat_deg':float, 'Lat_min':float, 'Lon_deg':float, 'Lon_min':float}
-        gps_file = settings.GPS_FILENAME
-        if not os.path.isfile(gps_file):
-            return None
-        df = pd.read_csv(gps_file, skiprows=[0, 2, 3], usecols=dtype.keys(), header=0, dtype=dtype, na_values=['NAN'], parse_dates=['TIMESTAMP'], index_col='TIMESTAMP')
-        df = df.tz_localize('UTC')
-        return df
+    @classmethod
+    def get_empty(cls):
+        """The row shared by every event without a fix, 0°0' at the 1970 default timestamp"""
+        return cls.objects.get_or_create(timestamp=EMPTY_FIX_TIMESTAMP)[0]
 
-    def _get_gps_record(self, df, timestamp):
-        try:
-            df = df.loc[~df.index.duplicated(keep='last')]
-            row = df.iloc[df.index.get_loc(timestamp, method='nearest', tolerance=pd.Timedelta('30 seconds'))]
-        except (AttributeError, KeyError):
-            row = None
-        return row
+    @classmethod
+    def locate(cls, timestamp):
+        """The stored fix nearest to timestamp within tolerance, None if the nav file has none"""
+        with metrics.span('GPS.locate'):
+            fix = nav.get_reader(settings.GPS_FILENAME).nearest(timestamp, tolerance=nav.TOLERANCE)
+            if fix is None or fix[['Lat_deg', 'Lat_min', 'Lon_deg', 'Lon_min']].isnull().any():
+                return None
+            defaults = {'latitude_degree': fix['Lat_deg'], 'latitude_minute': fix['Lat_min'], 'longitude_degree': fix['Lon_deg'], 'longitude_minute': fix['Lon_min']}
+            return cls.objects.get_or_create(timestamp=fix.name.to_pydatetime(), defaults=defaults)[0]
+
+    @classmethod
+    def get_fix_ids(cls, fixes):
+        """Row ids of nav fixes indexed by their timestamp, inserting the fixes that are not stored yet in one batch"""
+        timestamps = [ts.to_pydatetime() for ts in fixes.index]
+        ids = dict(cls.objects.filter(timestamp__in=timestamps).values_list('timestamp', 'id'))
+        new = []
+        for timestamp, row in zip(timestamps, fixes.to_dict('records')):
+            if timestamp not in ids:
+                gps = cls(latitude_degree=row['Lat_deg'], latitude_minute=row['Lat_min'], longitude_degree=row['Lon_deg'], longitude_minute=row['Lon_min'], timestamp=timestamp)
+                gps.set_decimal_degrees()
+                new.append(gps)
+        if new:
+            cls.objects.bulk_create(new, batch_size=500, ignore_conflicts=True)  # another worker may have stored the same fix
+            ids.update(cls.objects.filter(timestamp__in=[gps.timestamp for gps in new]).values_list('timestamp', 'id'))
+        return {pd.Timestamp(timestamp): pk for timestamp, pk in ids.items()}
+
+    def set_decimal_degrees(self):
+        if self.timestamp is None or winch.naive_utc(self.timestamp) <= winch.naive_utc(EMPTY_FIX_TIMESTAMP):
+            self.latitude = self.longitude = None  # no fix
+            return
+        self.latitude = get_decimal_degrees(self.latitude_degree, self.latitude_minute)
+        self.longitude = get_decimal_degrees(self.longitude_degree, self.longitude_minute)
+
+    def save(self, *args, **kwargs):
+        self.set_decimal_degrees()
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return '{}°{}'', {}°{} captured at {}'''.format(self.latitude_degree, self.latitude_minute, self.longitude_degree, self.longitude_minute, self.timestamp)
@@ -216,21 +386,53 @@ class ShipLog(models.Model):
     )
     gps = models.ForeignKey(
         'GPS',
-        on_delete=models.CASCADE,
+        on_delete=models.PROTECT,  # fixes are shared between events
         default=None,
         help_text='The timestamp will be used to find GPS data. If not GPS data is available, 0°0.0, 0°,0.0 will be used',
     )
     timestamp = models.DateTimeField()
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['cruise', 'device', 'event', 'timestamp']),  # deploy/recover pairing
+            models.Index(fields=['cruise', 'timestamp']),  # event log
+        ]
 
     def find_deployment(self):
-        """Given a recover event, find the related deploy event. Does not consider if a deployment already has a recovery"""
+        """Given a recover event, find the latest earlier deploy event of the device, unless it was already recovered"""
         same_cruise = models.Q(cruise=self.cruise)
         same_device = models.Q(device=self.device)
         deploy_event = models.Q(event__name='Deploy')
-        deployments = ShipLog.objects.filter(same_cruise & same_device & deploy_event)
+        before = models.Q(timestamp__lte=self.timestamp)
+        deployments = ShipLog.objects.filter(same_cruise & same_device & deploy_event & before)
         deployment = deployments.order_by('timestamp').last()
+        if deployment is not None and Cast.objects.filter(deployment=deployment).exclude(recovery=self).exists():
+            return None # the latest deployment was already recovered
         return deployment
 
+    @classmethod
+    def pair_events(cls, cruise):
+        """Walk the deploy and recover events of a cruise once, in time order, pairing them per device"""
+        events = cls.objects.filter(cruise=cruise, event__name__in=['Deploy', 'Recover'])
+        events = events.select_related('device', 'event').order_by('timestamp', 'id')
+        pairing = Pairing(pairs=[], orphan_deployments=[], orphan_recoveries=[], double_deployments=[])
+        deployed = {}
+        for shiplog in events:
+            if shiplog.event.name == 'Deploy':
+                if shiplog.device_id in deployed:
+                    # deployed again without a recovery, the latest deployment is the one that gets recovered
+                    pairing.double_deployments.append(deployed[shiplog.device_id])
+                deployed[shiplog.device_id] = shiplog
+                continue
+            deployment = deployed.pop(shiplog.device_id, None)
+            if deployment is None:
+                pairing.orphan_recoveries.append(shiplog)
+            else:
+                pairing.pairs.append((deployment, shiplog))
+        pairing.orphan_deployments.extend(deployed.values())
+        return pairing
+
     def find_config(self):
         configs = self.cruise.config.filter(device__id=self.device.id)
         if len(configs) > 1:
@@ -245,31 +447,146 @@ class ShipLog(models.Model):
     def get_all_logs(cls):
         return cls.objects.all().order_by('timestamp')
 
+    cruise_field = 'cruise'
+    export_fields = ['timestamp', 'device__name', 'event__name', 'gps__latitude_degree', 'gps__latitude_minute', 'gps__longitude_degree', 'gps__longitude_minute', 'gps__latitude', 'gps__longitude']
+
     @classmethod
     def _to_df(cls, log):
-        columns = list(log.values('timestamp', 'device_id', 'event_id', 'gps'))
-        df = pd.DataFrame(columns)
-        df['device_id'] = df['device_id'].apply(lambda x: Device.objects.get(pk=x))
-        df['event_id'] = df['event_id'].apply(lambda x: Event.objects.get(pk=x))
-        df['Latitude'] = df['gps'].apply(lambda x: "{}°{}'".format(GPS.objects.get(pk=x).latitude_degree, GPS.objects.get(pk=x).latitude_minute))
-        df['Longitude'] = df['gps'].apply(lambda x: "{}°{}'".format(GPS.objects.get(pk=x).longitude_degree, GPS.objects.get(pk=x).longitude_minute))
-        df['Date'] = df['timestamp'].dt.strftime('%Y-%m-%d')
-        df['Time'] = df['timestamp'].dt.strftime('%H:%M:%S')
-        df = df.drop(['timestamp', 'gps'], axis=1)
-        df = df.rename(columns={'device_id': 'Device', 'event_id': 'Event'})
+        df = pd.DataFrame.from_records(log.values_list(*cls.export_fields), columns=cls.export_fields)  # one joined query
+        return cls._format_df(df)
+
+    @classmethod
+    def _format_df(cls, df):
+        timestamp = pd.to_datetime(df['timestamp'], utc=True)
+        df['Date'] = timestamp.dt.strftime('%Y-%m-%d')
+        df['Time'] = timestamp.dt.strftime('%H:%M:%S')
+        df['Latitude'] = df['gps__latitude_degree'].astype(str) + '°' + df['gps__latitude_minute'].astype(str) + "'"
+        df['Longitude'] = df['gps__longitude_degree'].astype(str) + '°' + df['gps__longitude_minute'].astype(str) + "'"
+        df = df.rename(columns={'device__name': 'Device', 'event__name': 'Event'})
         df = df[['Date', 'Time', 'Device', 'Event', 'Latitude', 'Longitude']]  # reorder columns
         return df
 
+    @classmethod
+    def _typed_df(cls, df):
+        """Export fields with a real timestamp and signed decimal degrees, for the columnar downloads"""
+        if 'gps__latitude' not in df:
+            df = cls._add_decimal_degrees(df)  # a snapshot from before version 2
+        return pd.DataFrame({
+            'Timestamp': pd.to_datetime(df['timestamp'], utc=True),
+            'Device': df['device__name'].astype('string'),
+            'Event': df['event__name'].astype('string'),
+            'Latitude': df['gps__latitude'].astype(float),
+            'Longitude': df['gps__longitude'].astype(float),
+        })
+
+    @classmethod
+    def _add_decimal_degrees(cls, df):
+        """Signed decimal degrees from the degree and minute columns, NaN for events without a fix"""
+        df = df.copy()
+        empty = pd.Series(True, index=df.index)
+        for axis in ('latitude', 'longitude'):
+            degree = df['gps__{}_degree'.format(axis)].astype(float)
+            minute = df['gps__{}_minute'.format(axis)].astype(float)
+            sign = np.where((degree < 0) | (minute < 0), -1, 1)
+            df['gps__' + axis] = sign * (degree.abs() + minute.abs() / 60)
+            empty &= (degree == 0) & (minute == 0)
+        df.loc[empty, ['gps__latitude', 'gps__longitude']] = np.nan
+        return df
+
+    def locate(self):
+        """Look up the GPS fix for this event, False if the nav file has not reached its timestamp yet"""
+        last_fix = nav.get_reader(settings.GPS_FILENAME).last_timestamp
+        if last_fix is None or last_fix < self.timestamp:
+            return False
+        fix = GPS.locate(self.timestamp)
+        if fix is not None and fix.id != self.gps_id:
+            self.gps = fix
+            ShipLog.objects.filter(pk=self.pk).update(gps=fix, modified=datetime.now(pytz.utc))  # changes the export version
+        return True
+
+    import_columns = ['timestamp', 'device', 'event']
+
+    @classmethod
+    def validate_import(cls, cruise, df):
+        """Resolve the device and event names of imported rows, with an error for every line that can not be logged"""
+        missing = [c for c in cls.import_columns if c not in df.columns]
+        if missing:
+            return None, ['Missing columns: {}'.format(', '.join(missing))]
+        df = df[cls.import_columns].copy()
+        df['line'] = np.arange(len(df)) + 2  # line 1 is the header
+        df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce', utc=True)
+        devices = {d.name: d for d in Device.objects.filter(id__in=cruise.get_device_ids()).prefetch_related('events')}
+        errors = []
+        device_ids, event_ids = [], []
+        for line, timestamp, device_name, event_name in df[['line', 'timestamp', 'device', 'event']].itertuples(index=False):
+            device = devices.get(str(device_name).strip())
+            event = None
+            if device is not None:
+                event = next((e for e in device.events.all() if e.name == str(event_name).strip()), None)
+            if pd.isnull(timestamp):
+                errors.append('Line {}: unreadable timestamp'.format(line))
+            elif device is None:
+                errors.append('Line {}: {} is not configured for {}'.format(line, device_name, cruise))
+            elif event is None:
+                errors.append('Line {}: {} has no {} event'.format(line, device_name, event_name))
+            device_ids.append(device.id if device else None)
+            event_ids.append(event.id if event else None)
+        df['device_id'] = device_ids
+        df['event_id'] = event_ids
+        return df, errors
+
+    @classmethod
+    def import_events(cls, cruise, df):
+        """Log many events at once, matching all of their GPS fixes in one pass and analyzing the new casts as one batch"""
+        df, errors = cls.validate_import(cruise, df)
+        if errors:
+            return Import(shiplogs=[], duplicates=0, errors=errors)  # all or nothing
+        existing = set(cls.objects.filter(cruise=cruise, timestamp__in=df['timestamp'].dt.to_pydatetime()).values_list('device_id', 'event_id', 'timestamp'))
+        logged = [(d, e, t) in existing for d, e, t in zip(df['device_id'], df['event_id'], df['timestamp'].dt.to_pydatetime())]
+        df = df[~np.array(logged, dtype=bool)].drop_duplicates(['device_id', 'event_id', 'timestamp'])
+        duplicates = len(logged) - len(df)
+
+        fixes = nav.get_reader(settings.GPS_FILENAME).fixes.reset_index()
+        df = pd.merge_asof(df.sort_values('timestamp'), fixes, left_on='timestamp', right_on='TIMESTAMP', direction='nearest', tolerance=nav.TOLERANCE)
+        found = df.dropna(subset=['TIMESTAMP', 'Lat_deg', 'Lat_min', 'Lon_deg', 'Lon_min'])
+        with transaction.atomic():
+            fix_ids = GPS.get_fix_ids(found.drop_duplicates('TIMESTAMP').set_index('TIMESTAMP')[['Lat_deg', 'Lat_min', 'Lon_deg', 'Lon_min']])
+            empty_id = GPS.get_empty().id  # events without a fix are left for the GPS sweeper
+            shiplogs = [
+                cls(cruise=cruise, device_id=device_id, event_id=event_id, gps_id=fix_ids.get(fix, empty_id), timestamp=timestamp.to_pydatetime())
+                for device_id, event_id, timestamp, fix in df[['device_id', 'event_id', 'timestamp', 'TIMESTAMP']].itertuples(index=False)
+            ]
+            cls.objects.bulk_create(shiplogs)
+
+        # bulk_create does not return ids on every database, look the new recoveries up again
+        recover_event_ids = set(Event.objects.filter(name='Recover').values_list('id', flat=True))
+        imported = {(s.device_id, s.event_id, s.timestamp) for s in shiplogs if s.event_id in recover_event_ids}
+        recoveries = cls.objects.filter(cruise=cruise, event_id__in=recover_event_ids, timestamp__in=[t for d, e, t in imported]).order_by('timestamp')
+        recovery_ids = [r.id for r in recoveries if (r.device_id, r.event_id, r.timestamp) in imported]
+        if recovery_ids:
+            if settings.ASYNC:
+                # workers must not look the recoveries up before the caller's transaction commits them
+                transaction.on_commit(lambda: group(analyze_cast.s(recovery_id) for recovery_id in recovery_ids).apply_async())
+            else:
+                for recovery_id in recovery_ids:
+                    analyze_cast(recovery_id)
+        return Import(shiplogs=shiplogs, duplicates=duplicates, errors=[])
+
     def save(self, *args, **kwargs):
-        # when adding a shiplog in admin, there will be no GPS by default. Use the timestamp to try and find GPS data
-        if not hasattr(self, 'gps'):
-            gps = GPS()
-            gps.save(timestamp=self.timestamp)
-            self.gps = gps
+        # new events have no GPS yet, save them right away and use the timestamp to find GPS data in the background
+        locate = self.gps_id is None
+        if locate:
+            self.gps = GPS.get_empty()
         super().save(*args, **kwargs)
+        if locate:
+            if settings.ASYNC:
+                # the worker looks the event up, don't queue it before the caller's transaction commits
+                transaction.on_commit(lambda: locate_event.delay(self.id))
+            else:
+                self.locate()
         if self.event.name == 'Recover':
             if settings.ASYNC:
-                analyze_cast.delay(self.id)
+                transaction.on_commit(lambda: analyze_cast.delay(self.id))
             else:
                 analyze_cast(self.id)
 
@@ -281,87 +598,149 @@ class CastReport(models.Model):
     max_tension = models.DecimalField(max_digits=6, decimal_places=1, null=True, blank=True, default=None)
     max_payout = models.DecimalField(max_digits=6, decimal_places=1, null=True, blank=True, default=None)
     max_speed = models.DecimalField(max_digits=4, decimal_places=1, null=True, blank=True, default=None)
+    mean_tension = models.DecimalField(max_digits=6, decimal_places=1, null=True, blank=True, default=None)
+    duration = models.DurationField(null=True, blank=True, default=None)
+    modified = models.DateTimeField(auto_now=True)
 
     @classmethod
     def get_all_logs(cls):
         return cls.objects.all().order_by('cast__recovery__timestamp')
 
+    cruise_field = 'cast__cruise'
+    export_fields = ['cast__deployment__timestamp', 'cast__recovery__timestamp', 'cast__recovery__device__name', 'max_tension', 'max_speed', 'max_payout', 'cast__config__wire__serial_number', 'cast__config__winch']
+
     @classmethod
     def _to_df(cls, log):
-        columns = list(log.values('cast', 'max_tension', 'max_speed', 'max_payout'))
-        df = pd.DataFrame(columns)
-        df['Deployed Date'] = df['cast'].apply(lambda x: Cast.objects.get(pk=x).deployment.timestamp.strftime('%Y-%m-%d'))
-        df['Deployed Time'] = df['cast'].apply(lambda x: Cast.objects.get(pk=x).deployment.timestamp.strftime('%H:%M:%S'))
-        df['Recovered Date'] = df['cast'].apply(lambda x: Cast.objects.get(pk=x).recovery.timestamp.strftime('%Y-%m-%d'))
-        df['Recovered Time'] = df['cast'].apply(lambda x: Cast.objects.get(pk=x).recovery.timestamp.strftime('%H:%M:%S'))
-        df['Device'] = df['cast'].apply(lambda x: Cast.objects.get(pk=x).recovery.device)
-        df['Wire'] = df['cast'].apply(lambda x: Cast.objects.get(pk=x).config.wire.serial_number)
-        df['Winch #'] = df['cast'].apply(lambda x: Cast.objects.get(pk=x).config.winch)
-        df = df.drop(['cast'], axis=1)
+        df = pd.DataFrame.from_records(log.values_list(*cls.export_fields), columns=cls.export_fields)  # one joined query
+        return cls._format_df(df)
+
+    @classmethod
+    def _format_df(cls, df):
+        deployed = pd.to_datetime(df['cast__deployment__timestamp'], utc=True)
+        recovered = pd.to_datetime(df['cast__recovery__timestamp'], utc=True)
+        df['Deployed Date'] = deployed.dt.strftime('%Y-%m-%d')
+        df['Deployed Time'] = deployed.dt.strftime('%H:%M:%S')
+        df['Recovered Date'] = recovered.dt.strftime('%Y-%m-%d')
+        df['Recovered Time'] = recovered.dt.strftime('%H:%M:%S')
         df = df.rename(columns={
+            'cast__recovery__device__name': 'Device',
             'max_tension': 'Max Tension',
             'max_speed': 'Max Speed',
             'max_payout': 'Max Payout',
+            'cast__config__wire__serial_number': 'Wire',
+            'cast__config__winch': 'Winch #',
         })
         df = df[['Deployed Date', 'Deployed Time', 'Recovered Date', 'Recovered Time', 'Device', 'Max Tension', 'Max Speed', 'Max Payout', 'Wire', 'Winch #']] # reorder columns
         return df
 
+    @classmethod
+    def _typed_df(cls, df):
+        """Export fields with real timestamps and numeric maxima, for the columnar downloads"""
+        return pd.DataFrame({
+            'Deployed': pd.to_datetime(df['cast__deployment__timestamp'], utc=True),
+            'Recovered': pd.to_datetime(df['cast__recovery__timestamp'], utc=True),
+            'Device': df['cast__recovery__device__name'].astype('string'),
+            'Max Tension': df['max_tension'].astype(float),
+            'Max Speed': df['max_speed'].astype(float),
+            'Max Payout': df['max_payout'].astype(float),
+            'Wire': df['cast__config__wire__serial_number'].astype('string'),
+            'Winch #': df['cast__config__winch'].astype('Int64'),
+        })
+
     @classmethod
     def get_log(cls, cruise):
         has_winch_number = models.Q(cast__config__winch__gt=0)
         this_cruise = models.Q(cast__cruise_id=cruise.id)
         return cls.objects.filter(has_winch_number & this_cruise).order_by('cast__recovery__timestamp')
 
-    def get_winch_data(self):
-        deploy_date = self.cast.deployment.timestamp.date()
-        recover_date = self.cast.recovery.timestamp.date()
-        device_id = self.cast.config.device.id
+    def iter_winch_data(self):
+        deploy_time = self.cast.deployment.timestamp
+        recover_time = self.cast.recovery.timestamp
         winch_number = self.cast.config.winch
         if not winch_number:
-            return None
+            return
+        for f in winch.files_between(deploy_time.date(), recover_time.date()):
+            for df in f.iter_range(deploy_time, recover_time, winch_number):
+                yield df
 
-        # TODO: put some of these in settings
-        winch_cols = [2, 3, 4]
-        usecols = [0, 1]
-        usecols.extend([a + 3 * (winch_number - 1) for a in winch_cols])
-        names = ['Seconds', 'Date', 'Tension', 'Speed', 'Payout']
-        skiprows = [0, 1, 2, 3, 4, 5, 6, 7, 9]
-        winch_data = []
-        for f in glob(settings.WINCH_DATAFILE_PATH):
-            if not os.path.isfile(f):
-                continue
-            winch_date = datetime.strptime(ntpath.basename(f), '%Y-%m-%d %H-%M-%S WinchDAC.csv').date()
-            if deploy_date <= winch_date and winch_date <= recover_date:
-                copyfile(f, settings.WINCH_FILE_COPY)
-                df = pd.read_csv(settings.WINCH_FILE_COPY, skiprows=skiprows, usecols=usecols)
-                df['Clock'] = pd.to_datetime(df['Clock'], format='%m/%d/%Y %I:%M:%S %p')
-                df.columns = names
-                winch_data.append(df)
+    def get_winch_data(self):
         try:
-            df = pd.concat(winch_data)
+            with metrics.span('CastReport.get_winch_data'):
+                df = pd.concat(self.iter_winch_data())
         except ValueError:
             return None # winch data was not found
         return df
 
     def subset_winch_data(self, df):
-        deploy_time = self.cast.deployment.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        recover_time= self.cast.recovery.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+        deploy_time = winch.naive_utc(self.cast.deployment.timestamp)
+        recover_time = winch.naive_utc(self.cast.recovery.timestamp)
         subset = df[(deploy_time <= df['Date']) & (df['Date'] <= recover_time)]
         return subset
 
-    def set_cast_report(self, df):
-        try:
-            df = self.subset_winch_data(df)
-            if not df.empty and not df['Tension'].isnull().all():
-                self.max_tension = float(df['Tension'].max()) # in lbs
-                self.max_payout = float(df['Payout'].max()) # in meters
-                self.max_speed = float(df['Speed'].max()) # in meters per minute
-        except (AttributeError, TypeError):
-            pass
-
-    def save(self, *args, **kwargs):
+    def get_profile(self, width):
+        """Tension, speed and payout decimated for a plot width pixels wide, cached per cast and width"""
+        key = CAST_PROFILE_KEY.format(self.id, width, self.modified)
+        profile = cache.get(key)
+        if profile is not None:
+            return profile
         df = self.get_winch_data()
-        self.set_cast_report(df)
+        if df is None:
+            df = pd.DataFrame(columns=['Date'] + winch.CHANNELS)
+        df = winch.decimate(self.subset_winch_data(df), width)
+        profile = {'time': (df['Date'].values.astype('datetime64[ms]').astype(np.int64)).tolist()}
+        for channel in winch.CHANNELS:
+            values = df[channel].astype(float)
+            profile[channel.lower()] = values.astype(object).where(values.notnull(), None).tolist()
+        cache.set(key, profile, settings.CAST_PROFILE_TIMEOUT)
+        return profile
+
+    def set_cast_report(self, chunks, usage=None):
+        """Cast statistics in one pass over chunks of winch data, which also feeds the wire usage when given"""
+        stats = winch.CastStats()
+        with metrics.span('CastReport.set_cast_report'):
+            try:
+                for df in chunks:
+                    df = self.subset_winch_data(df)
+                    stats.update(df)
+                    if usage is not None:
+                        usage.update(df)
+            except (AttributeError, TypeError):
+                if usage is not None:
+                    usage.samples = 0  # a partial pass would undercount, WireUsage.record skips it
+        self.set_stats(stats)
+
+    def set_rollup_usage(self, usage):
+        """Feed the wire usage the 1 s buckets of the cast, the rainflow count runs on their mean tension"""
+        df = WinchRollup.get_series(self.cast.config.winch, self.cast.deployment.timestamp, self.cast.recovery.timestamp, 1)
+        usage.update(pd.DataFrame({'Date': df.index.values, 'Tension': df['tension_mean'].values, 'Payout': df['payout_mean'].values}))
+        usage.samples = int(df['samples'].sum())
+
+    def set_stats(self, stats):
+        if stats.tension_count:
+            self.max_tension = stats.max_tension # in lbs
+            self.max_payout = stats.max_payout # in meters
+            self.max_speed = stats.max_speed # in meters per minute
+            self.mean_tension = stats.mean_tension # in lbs
+            self.duration = stats.duration
+
+    def get_rollup_stats(self):
+        winch_number = self.cast.config.winch
+        if not winch_number:
+            return None
+        return WinchRollup.get_cast_stats(winch_number, self.cast.deployment.timestamp, self.cast.recovery.timestamp)
+
+    def analyze(self, usage=None):
+        """Cast statistics, and the wire usage when given, from the rollups or else one pass over the winch files"""
+        stats = self.get_rollup_stats()
+        if stats is None:
+            self.set_cast_report(self.iter_winch_data(), usage)  # the ingester has not covered this cast
+        else:
+            self.set_stats(stats)
+            if usage is not None:
+                self.set_rollup_usage(usage)
+
+    def save(self, *args, usage=None, **kwargs):
+        self.analyze(usage)
         super().save(*args, **kwargs)
 
 class Cast(models.Model):
@@ -392,7 +771,10 @@ class Cast(models.Model):
         self.cruise = self.recovery.cruise
         super().save(*args, **kwargs)
         cast_report = CastReport(cast=self)
-        cast_report.save()
+        usage = WireUsage.get_stats() if self.config.wire_id else None
+        cast_report.save(usage=usage)
+        if usage is not None:
+            WireUsage.record(self, usage)
 
     def __str__(self):
         return '{cruise} {device} cast recovered at {ts:%H:%M} on {ts:%Y-%m-%d}'.format(cruise=self.recovery.cruise.name, device=self.recovery.device.name, ts=self.recovery.timestamp)
@@ -401,26 +783,39 @@ class WireReport(models.Model):
     start_date = models.DateField()
     end_date = models.DateField()
     wire = models.ForeignKey(Wire, on_delete=models.CASCADE, default=None)
+    format = models.CharField(max_length=8, choices=formats.FORMAT_CHOICES, default='csv', help_text='Parquet and Feather keep typed columns for analysis ashore')
 
     def _make_df(self, casts):
-        columns = list(casts.values('cast', 'max_tension', 'max_speed', 'max_payout'))
-        df = pd.DataFrame(columns)
-        df['Date'] = df['cast'].apply(lambda x: Cast.objects.get(pk=x).recovery.timestamp)
-        df = df.rename(columns={
-            'max_tension': 'Max Tension',
-            'max_speed': 'Max Speed',
-            'max_payout': 'Max Payout',
+        fields = ['cast__recovery__timestamp', 'max_tension', 'max_speed', 'max_payout']
+        df = pd.DataFrame.from_records(casts.values_list(*fields), columns=fields)  # one joined query
+        return pd.DataFrame({
+            'Date': pd.to_datetime(df['cast__recovery__timestamp'], utc=True),
+            'Max Tension': df['max_tension'].astype(float),
+            'Max Speed': df['max_speed'].astype(float),
+            'Max Payout': df['max_payout'].astype(float),
         })
-        df = df.drop(['cast'], axis=1)
-        df = df[['Date', 'Max Tension', 'Max Speed', 'Max Payout']] # reorder columns
-        return df
+
+    def clean(self):
+        if self.format in formats.COLUMNAR:
+            try:
+                formats.get_pyarrow()
+            except ImproperlyConfigured as e:
+                raise ValidationError({'format': str(e)})
+
+    def get_usage(self):
+        """Usage of the wire over the casts of this report and over its whole life"""
+        return {
+            'period': WireUsage.get_totals(self.wire, self.start_date, self.end_date + timedelta(days=1)),
+            'lifetime': WireUsage.get_totals(self.wire),
+        }
+
+    def get_filename(self):
+        return formats.get_filename(settings.WIRE_REPORT_FILENAME.format(self.wire.serial_number), self.format)
 
     def _save_wire_report(self, casts):
         df = self._make_df(casts)
-        filename = settings.WIRE_REPORT_FILENAME.format(self.wire.serial_number)
-        root_path = os.path.dirname(__file__)
-        outfile = os.path.join(root_path, os.pardir, 'media', filename)
-        df.to_csv(outfile)
+        outfile = os.path.join(settings.MEDIA_ROOT, self.get_filename())
+        formats.write(df, outfile, self.format)
 
     def run_wire_report(self):
         casts = self._get_relevant_casts()
@@ -446,3 +841,205 @@ class WireReport(models.Model):
 
     def __str__(self):
         return 'Wire Report for {} from {} to {}'.format(self.wire.serial_number, self.start_date, self.end_date)
+
+class WireUsage(models.Model):
+    """Partial sums of the wear of a wire over one cast, lifetime totals are their sums"""
+    cast = models.OneToOneField(Cast, on_delete=models.CASCADE, related_name='wire_usage')
+    wire = models.ForeignKey(Wire, on_delete=models.CASCADE)
+    recovered = models.DateTimeField()
+    samples = models.IntegerField(default=0)
+    seconds = models.FloatField(default=0.0)
+    meters_out = models.FloatField(default=0.0, help_text='Wire paid out in meters')
+    meters_in = models.FloatField(default=0.0, help_text='Wire hauled in in meters')
+    cycles = models.FloatField(default=0.0, help_text='Rainflow tension cycles of at least WIRE_CYCLE_MIN_RANGE lbs')
+    damage = models.FloatField(default=0.0, help_text='Sum of cycle range ** WIRE_SN_EXPONENT, relative fatigue damage')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['wire', 'recovered']),  # lifetime totals of a wire over a date range
+        ]
+
+    @classmethod
+    def get_stats(cls):
+        return winch.UsageStats(settings.WIRE_TENSION_THRESHOLDS, settings.WIRE_CYCLE_MIN_RANGE, settings.WIRE_SN_EXPONENT)
+
+    @classmethod
+    def record(cls, cast, stats):
+        """Store the wear of a cast measured by stats, casts without a wire or without winch data have none"""
+        if cast.config.wire_id is None:
+            return None
+        stats.close()
+        with transaction.atomic():
+            if not stats.samples:
+                cls.objects.filter(cast=cast).delete()  # better no usage than zeros counted into the totals
+                return None
+            usage, _ = cls.objects.update_or_create(cast=cast, defaults={
+                'wire_id': cast.config.wire_id,
+                'recovered': cast.recovery.timestamp,
+                'samples': stats.samples,
+                'seconds': stats.seconds,
+                'meters_out': stats.meters_out,
+                'meters_in': stats.meters_in,
+                'cycles': stats.rainflow.cycles,
+                'damage': stats.rainflow.damage,
+            })
+            usage.loads.all().delete()
+            WireLoad.objects.bulk_create([
+                WireLoad(usage=usage, threshold=threshold, seconds=seconds)
+                for threshold, seconds in zip(stats.tension_thresholds, stats.seconds_above)
+            ])
+        return usage
+
+    @classmethod
+    def measure(cls, cast_report):
+        """Measure and store the wear of the cast of a report, from the rollups or else one pass over its winch files"""
+        with metrics.span('WireUsage.measure'):
+            stats = cls.get_stats()
+            cast_report.analyze(stats)
+            return cls.record(cast_report.cast, stats)
+
+    @classmethod
+    def get_totals(cls, wire, start=None, end=None):
+        """Lifetime totals of a wire, or of the casts recovered between start and end"""
+        usage = cls.objects.filter(wire=wire)
+        if start is not None:
+            usage = usage.filter(recovered__gte=start)
+        if end is not None:
+            usage = usage.filter(recovered__lte=end)
+        totals = usage.aggregate(
+            casts=models.Count('id'),
+            seconds=models.Sum('seconds'),
+            meters_out=models.Sum('meters_out'),
+            meters_in=models.Sum('meters_in'),
+            cycles=models.Sum('cycles'),
+            damage=models.Sum('damage'),
+        )
+        loads = WireLoad.objects.filter(usage__in=usage).values('threshold').annotate(seconds=models.Sum('seconds')).order_by('threshold')
+        totals['seconds_above'] = [(load['threshold'], load['seconds']) for load in loads]
+        return totals
+
+    def __str__(self):
+        return 'Wire {} usage of {}'.format(self.wire.serial_number, self.cast)
+
+class WireLoad(models.Model):
+    """Seconds a cast held its wire above a tension threshold"""
+    usage = models.ForeignKey(WireUsage, on_delete=models.CASCADE, related_name='loads')
+    threshold = models.FloatField(help_text='Tension in lbs')
+    seconds = models.FloatField(default=0.0)
+
+class WinchRollup(models.Model):
+    """Min, max and mean of each winch channel per 1 s, 10 s or 1 min bucket, written by the ingest_winch command"""
+    winch = models.IntegerField(choices=settings.WINCH_CHOICES)
+    resolution = models.IntegerField(help_text='Seconds per bucket')
+    timestamp = models.DateTimeField(help_text='Start of the bucket')
+    samples = models.IntegerField(default=0)
+    tension_samples = models.IntegerField(default=0, help_text='Samples with a tension, the weight of tension_mean')
+    tension_min = models.FloatField(null=True)
+    tension_max = models.FloatField(null=True)
+    tension_mean = models.FloatField(null=True)
+    speed_min = models.FloatField(null=True)
+    speed_max = models.FloatField(null=True)
+    speed_mean = models.FloatField(null=True)
+    payout_min = models.FloatField(null=True)
+    payout_max = models.FloatField(null=True)
+    payout_mean = models.FloatField(null=True)
+
+    stats = ['tension_min', 'tension_max', 'tension_mean', 'speed_min', 'speed_max', 'speed_mean', 'payout_min', 'payout_max', 'payout_mean']
+
+    class Meta:
+        unique_together = ('winch', 'resolution', 'timestamp')
+
+    @classmethod
+    def add(cls, winch_number, df):
+        """Fold new samples of one winch (Date, Tension, Speed, Payout) into every resolution"""
+        if df.empty:
+            return
+        for resolution in winch.ROLLUP_RESOLUTIONS:
+            rollups = winch.rollup(df, resolution)
+            rollups = rollups.astype(object).where(rollups.notnull(), None)
+            timestamps = [pytz.utc.localize(ts.to_pydatetime()) for ts in rollups.index]
+            # samples arrive in time order so only the first bucket can already hold some of them
+            existing = {r.timestamp: r for r in cls.objects.filter(winch=winch_number, resolution=resolution, timestamp__gte=timestamps[0])}
+            new, changed = [], []
+            for timestamp, row in zip(timestamps, rollups.to_dict('records')):
+                rollup = existing.get(timestamp)
+                if rollup is None:
+                    new.append(cls(winch=winch_number, resolution=resolution, timestamp=timestamp, **row))
+                else:
+                    rollup.merge(row)
+                    changed.append(rollup)
+            cls.objects.bulk_create(new, batch_size=500)
+            cls.objects.bulk_update(changed, ['samples', 'tension_samples'] + cls.stats)
+
+    def merge(self, row):
+        for channel in winch.CHANNELS:
+            channel = channel.lower()
+            low, high, mean = [(getattr(self, channel + s), row[channel + s]) for s in ('_min', '_max', '_mean')]
+            setattr(self, channel + '_min', min(v for v in low if v is not None) if any(v is not None for v in low) else None)
+            setattr(self, channel + '_max', max(v for v in high if v is not None) if any(v is not None for v in high) else None)
+            weights = (self.tension_samples, row['tension_samples']) if channel == 'tension' else (self.samples, row['samples'])
+            if mean[0] is None or mean[1] is None:
+                setattr(self, channel + '_mean', mean[1] if mean[0] is None else mean[0])
+            else:
+                setattr(self, channel + '_mean', (mean[0] * weights[0] + mean[1] * weights[1]) / (weights[0] + weights[1]))
+        self.samples += row['samples']
+        self.tension_samples += row['tension_samples']
+
+    @classmethod
+    def last_timestamp(cls, winch_number):
+        return cls.objects.filter(winch=winch_number, resolution=1).aggregate(last=models.Max('timestamp'))['last']
+
+    @classmethod
+    def is_behind(cls, winch_number, timestamp):
+        """Whether the winch is being rolled up but its 1 s buckets have not reached timestamp yet"""
+        if not winch_number:
+            return False
+        last = cls.last_timestamp(winch_number)
+        return last is not None and last < pytz.utc.localize(winch.naive_utc(timestamp).to_pydatetime())
+
+    @classmethod
+    def get_cast_stats(cls, winch_number, start, end):
+        """Cast statistics from 1 min buckets with 1 s buckets at the edges, None if the rollups do not cover start to end"""
+        start = pytz.utc.localize(winch.naive_utc(start).to_pydatetime())
+        end = pytz.utc.localize(winch.naive_utc(end).to_pydatetime())
+        seconds = cls.objects.filter(winch=winch_number, resolution=1)
+        last = seconds.aggregate(last=models.Max('timestamp'))['last']
+        if last is None or last < end:
+            return None  # not ingested this far yet
+        span = seconds.filter(timestamp__gte=start, timestamp__lte=end).aggregate(first=models.Min('timestamp'), last=models.Max('timestamp'), buckets=models.Count('id'))
+        expected = (end - start).total_seconds() + 1  # the winches are logged at 1 Hz
+        if span['buckets'] < expected * settings.WINCH_ROLLUP_MIN_COVERAGE:
+            return None  # the ingester missed part of the cast, or its 1 s buckets were pruned
+        inner_start = start + timedelta(seconds=-start.second % 60)
+        inner_end = (end + timedelta(seconds=1)).replace(second=0)
+        if inner_start < inner_end:
+            buckets = models.Q(resolution=60, timestamp__gte=inner_start, timestamp__lt=inner_end)
+            buckets |= models.Q(resolution=1, timestamp__gte=start, timestamp__lt=inner_start)
+            buckets |= models.Q(resolution=1, timestamp__gte=inner_end, timestamp__lte=end)
+        else:
+            buckets = models.Q(resolution=1, timestamp__gte=start, timestamp__lte=end)
+        totals = cls.objects.filter(models.Q(winch=winch_number) & buckets).aggregate(
+            max_tension=models.Max('tension_max'),
+            max_payout=models.Max('payout_max'),
+            max_speed=models.Max('speed_max'),
+            tension_sum=models.Sum(models.F('tension_mean') * models.F('tension_samples'), output_field=models.FloatField()),
+            tension_count=models.Sum('tension_samples'),
+        )
+        stats = winch.CastStats()
+        stats.max_tension = totals['max_tension']
+        stats.max_payout = totals['max_payout']
+        stats.max_speed = totals['max_speed']
+        stats.tension_sum = totals['tension_sum'] or 0.0
+        stats.tension_count = totals['tension_count'] or 0
+        stats.first_time, stats.last_time = span['first'], span['last']
+        return stats
+
+    @classmethod
+    def get_series(cls, winch_number, start, end, resolution):
+        """Buckets of one resolution between start and end as a frame indexed by time"""
+        rollups = cls.objects.filter(winch=winch_number, resolution=resolution, timestamp__gte=start, timestamp__lte=end).order_by('timestamp')
+        df = pd.DataFrame.from_records(rollups.values_list('timestamp', 'samples', *cls.stats), columns=['timestamp', 'samples'] + cls.stats)
+        return df.set_index('timestamp')
+
+    def __str__(self):
+        return 'Winch #{} {} s from {:%Y-%m-%d %H:%M:%S}'.format(self.winch, self.resolution, self.timestamp)
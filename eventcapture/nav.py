@@ -0,0 +1,116 @@
+import io
+import os
+import csv
+import threading
+from glob import glob
+import pandas as pd
+from django.conf import settings
+
+TOLERANCE = pd.Timedelta('30 seconds')
+
+class NavReader(object):
+    """Follows the tail of a Campbell TOA5 nav file, parsing only the bytes appended since the last refresh"""
+    header_lines = 4  # file info, column names, units, processing
+    dtype = {'TIMESTAMP':str, 'Lat_deg':float, 'Lat_min':float, 'Lon_deg':float, 'Lon_min':float}
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, inode):
+        self.inode = inode
+        self.offset = 0
+        self.columns = None
+        self.fixes = self._empty_frame()
+
+    def _empty_frame(self):
+        columns = [c for c in self.dtype if c != 'TIMESTAMP']
+        index = pd.DatetimeIndex([], name='TIMESTAMP', tz='UTC')
+        return pd.DataFrame(columns=columns, index=index, dtype=float)
+
+    def refresh(self):
+        with self._lock:
+            try:
+                stat = os.stat(self.filename)
+            except OSError:
+                self._reset(None)
+                return self
+            if stat.st_ino != self.inode or stat.st_size < self.offset:
+                # the file was rotated or truncated, start over
+                self._reset(stat.st_ino)
+            if stat.st_size == self.offset:
+                return self
+            with open(self.filename, 'rb') as f:
+                f.seek(self.offset)
+                chunk = f.read(stat.st_size - self.offset)
+            end = chunk.rfind(b'\n') + 1  # never parse a partially written line
+            if end:
+                self._consume(chunk[:end])
+            return self
+
+    def _consume(self, chunk):
+        data = chunk
+        if self.columns is None:
+            lines = chunk.split(b'\n', self.header_lines)
+            if len(lines) <= self.header_lines:
+                return  # wait until the whole header has been written
+            self.columns = next(csv.reader([lines[1].decode()]))
+            data = lines[self.header_lines]
+        self.offset += len(chunk)
+        if data.strip():
+            self._append(self._parse(data))
+
+    def _parse(self, data):
+        df = pd.read_csv(io.BytesIO(data), header=None, names=self.columns, usecols=self.dtype.keys(), dtype=self.dtype, na_values=['NAN'], parse_dates=['TIMESTAMP'], index_col='TIMESTAMP')
+        df = df.tz_localize('UTC')
+        return df
+
+    def _append(self, df):
+        fixes = self.fixes
+        in_order = df.index.is_monotonic_increasing and df.index.is_unique
+        if in_order and (fixes.empty or fixes.index[-1] < df.index[0]):
+            self.fixes = pd.concat([fixes, df])
+            return
+        fixes = pd.concat([fixes, df]).sort_index(kind='mergesort')
+        self.fixes = fixes.loc[~fixes.index.duplicated(keep='last')]
+
+    @property
+    def last_timestamp(self):
+        fixes = self.fixes
+        return fixes.index[-1] if len(fixes) else None
+
+    def nearest(self, timestamp, tolerance=TOLERANCE):
+        """Binary search for the fix closest to timestamp, None if there is none within tolerance"""
+        fixes = self.fixes
+        if timestamp is None or fixes.empty:
+            return None
+        timestamp = pd.Timestamp(timestamp)
+        if timestamp.tz is None:
+            timestamp = timestamp.tz_localize('UTC')
+        index = fixes.index
+        i = index.searchsorted(timestamp)
+        candidates = [j for j in (i - 1, i) if 0 <= j < len(index)]
+        j = min(candidates, key=lambda j: abs(index[j] - timestamp))
+        if abs(index[j] - timestamp) > tolerance:
+            return None
+        return fixes.iloc[j]
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+def get_reader(filename=None):
+    """Process-wide reader for a nav file, refreshed with whatever has been appended since the last call"""
+    filename = filename or settings.GPS_FILENAME
+    with _readers_lock:
+        reader = _readers.get(filename)
+        if reader is None:
+            reader = _readers[filename] = NavReader(filename)
+    return reader.refresh()
+
+def get_history():
+    """Fixes of the live nav file and every archived one under GPS_ARCHIVE_PATH, sorted and without duplicates"""
+    frames = [NavReader(path).refresh().fixes for path in sorted(glob(settings.GPS_ARCHIVE_PATH))]
+    frames.append(get_reader().fixes)
+    fixes = pd.concat(frames).sort_index(kind='mergesort')
+    return fixes.loc[~fixes.index.duplicated(keep='last')]
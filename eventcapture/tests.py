@@ -1,3 +1,639 @@
-from django.test import TestCase
+import io
+import os
+import gzip
+import pytz
+import numpy as np
+import tempfile
+import unittest
+from unittest import mock
+import pandas as pd
+from datetime import datetime, timedelta
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from eventcapture import archive, nav, utils, winch
+from eventcapture.benchmarks import write_winch_file
+from eventcapture.models import analyze_cast, Cruise, Device, Event, ShipLog, Cast, CastReport, Wire, Config, GPS, WinchRollup, WireUsage
 
-# Create your tests here.
+class TemporaryDirectoryMixin(object):
+    def use_directory(self, *names, **paths):
+        """A directory removed after the test, the settings in names point at it and those in paths at files in it"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = dict({name: directory.name for name in names}, **{name: os.path.join(directory.name, path) for name, path in paths.items()})
+        if overrides:
+            settings_override = self.settings(**overrides)
+            settings_override.enable()
+            self.addCleanup(settings_override.disable)
+        return directory.name
+
+@override_settings(ASYNC=False)
+class CruiseTestCase(TemporaryDirectoryMixin, TestCase):
+    """A cruise with one device configured, deployed and recovered from start on"""
+    start = datetime(2019, 1, 2, tzinfo=pytz.utc)
+    device_name = 'CTD'
+    serial_number = None  # no wire
+    winch = 2
+    end_date = None
+
+    def setUp(self):
+        self.deploy = Event.objects.create(name='Deploy')
+        self.recover = Event.objects.create(name='Recover')
+        self.device = Device.objects.create(name=self.device_name)
+        self.device.events.add(self.deploy, self.recover)
+        wire = Wire.objects.create(name='CTD wire', serial_number=self.serial_number) if self.serial_number else None
+        self.config = Config.objects.create(device=self.device, wire=wire, winch=self.winch)
+        self.cruise = Cruise.objects.create(name='Test Cruise', number='TC01', start_date=datetime(2019, 1, 1, tzinfo=pytz.utc), end_date=self.end_date)
+        self.cruise.config.add(self.config)
+
+    def log(self, event, **offset):
+        shiplog = ShipLog(cruise=self.cruise, device=self.device, event=event, gps=GPS.get_empty(), timestamp=self.start + timedelta(**offset))
+        shiplog.save()
+        return shiplog
+
+    def log_cast(self, seconds=40 * 60, **offset):
+        """Deploy at start plus offset and recover seconds later"""
+        deployment = self.log(self.deploy, **offset)
+        offset['seconds'] = offset.get('seconds', 0) + seconds
+        return deployment, self.log(self.recover, **offset)
+
+class CastReportExportTest(CruiseTestCase):
+    serial_number = '0.322-1'
+
+    def test_export_query_count_does_not_grow_with_casts(self):
+        for n in (1, 5):
+            for i in range(n):
+                self.log_cast(hours=CastReport.objects.count())
+            with self.assertNumQueries(1):
+                df = CastReport._to_df(CastReport.get_log(self.cruise))
+            self.assertEqual(len(df), CastReport.objects.count())
+
+    def test_export_columns(self):
+        self.log_cast(hours=12)
+        row = CastReport._to_df(CastReport.get_log(self.cruise)).iloc[0]
+        self.assertEqual(row['Deployed Date'], '2019-01-02')
+        self.assertEqual(row['Deployed Time'], '12:00:00')
+        self.assertEqual(row['Recovered Time'], '12:40:00')
+        self.assertEqual(row['Device'], 'CTD')
+        self.assertEqual(row['Wire'], '0.322-1')
+        self.assertEqual(row['Winch #'], 2)
+
+    def test_typed_export_columns(self):
+        self.log_cast(hours=12)
+        records = CastReport.get_log(self.cruise).values_list(*CastReport.export_fields)
+        row = CastReport._typed_df(pd.DataFrame.from_records(records, columns=CastReport.export_fields)).iloc[0]
+        self.assertEqual(row['Deployed'], pd.Timestamp('2019-01-02 12:00', tz='UTC'))
+        self.assertEqual(row['Recovered'], pd.Timestamp('2019-01-02 12:40', tz='UTC'))
+        self.assertEqual(row['Winch #'], 2)
+
+    def test_gzipped_download_matches_csv(self):
+        self.log_cast(hours=12)
+        url = '/download/wirelog/{}/'.format(self.cruise.id)
+        with tempfile.TemporaryDirectory() as exports, self.settings(EXPORT_CACHE_PATH=exports):
+            csv = b''.join(self.client.get(url).streaming_content)
+            response = self.client.get(url + '?format=csv.gz')
+            self.assertEqual(response['Content-Type'], 'application/gzip')
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), csv)
+
+class DecimateTest(SimpleTestCase):
+    def test_long_cast_keeps_the_peak_of_every_bucket(self):
+        width = 4000
+        times = pd.date_range('2019-01-01', periods=30 * 24 * 60, freq='min')  # a month, past the int64 overflow at this width
+        tension = np.random.RandomState(0).uniform(0, 1000, len(times))
+        df = pd.DataFrame({'Date': times, 'Tension': tension, 'Speed': 1.0, 'Payout': 2.0})
+        kept = winch.decimate(df, width)
+        slices = np.minimum(np.arange(len(times)) * width // (len(times) - 1), width - 1)
+        peaks = df.groupby(slices)['Tension'].max()
+        self.assertEqual(len(peaks), width)
+        self.assertTrue(peaks.isin(kept['Tension']).all())
+
+class RainflowTest(SimpleTestCase):
+    series = [-2, 1, -3, 5, -1, 3, -4, 4, -2]  # the example of ASTM E1049
+
+    def count(self, chunks):
+        rainflow = winch.Rainflow(exponent=1)
+        for chunk in chunks:
+            rainflow.update(chunk)
+        rainflow.close()
+        return rainflow
+
+    def test_astm_example(self):
+        rainflow = self.count([self.series])
+        self.assertEqual(rainflow.cycles, 4.0)  # 0.5 of 3, 1.5 of 4, 0.5 of 6, 1 of 8 and 0.5 of 9
+        self.assertEqual(rainflow.damage, 0.5 * 3 + 1.5 * 4 + 0.5 * 6 + 1 * 8 + 0.5 * 9)
+
+    def test_chunks_do_not_change_the_count(self):
+        whole = self.count([self.series])
+        for size in (1, 2, 4):
+            chunked = self.count([self.series[i:i + size] for i in range(0, len(self.series), size)])
+            self.assertEqual((chunked.cycles, chunked.damage), (whole.cycles, whole.damage))
+
+class DownloadCacheTest(CruiseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = '/download/eventlog/{}/'.format(self.cruise.id)
+        self.exports = self.use_directory('EXPORT_CACHE_PATH')
+        self.log(self.deploy)
+
+    def download(self, url, **headers):
+        response = self.client.get(url, **headers)
+        if response.status_code == 200:
+            b''.join(response.streaming_content)  # the export is cached once it has been streamed
+        return response
+
+    def cached(self):
+        return sorted(os.listdir(self.exports))
+
+    def test_unchanged_log_is_not_modified(self):
+        first = self.download(self.url)
+        self.assertEqual(self.download(self.url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertEqual(self.download(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+    def test_cached_export_is_reused(self):
+        first = self.download(self.url)
+        self.assertEqual(len(self.cached()), 1)
+        second = self.client.get(self.url)
+        self.assertEqual(type(second).__name__, 'FileResponse')
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_saved_row_replaces_the_stale_export_of_its_format_only(self):
+        first = self.download(self.url)
+        self.download(self.url + '?format=csv.gz')
+        stale = self.cached()
+        self.log(self.deploy, hours=1)
+        changed = self.download(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+        cached = self.cached()
+        self.assertEqual(len(cached), 2)
+        self.assertIn([name for name in stale if name.endswith('.csv.gz')][0], cached)  # the gzipped export is left until it is asked for
+        self.assertNotIn([name for name in stale if name.endswith('.csv')][0], cached)
+
+class LogDataTest(CruiseTestCase):
+    device_name = serial_number = '<img src=x onerror=alert(1)>'
+
+    def setUp(self):
+        super().setUp()
+        self.log_cast()
+
+    def test_names_are_escaped(self):
+        for url in ('/eventlog/data/', '/wirelog/data/'):
+            rows = self.client.get(url, {'draw': 1, 'start': 0, 'length': 10}).json()['data']
+            self.assertTrue(rows, url)
+            for row in rows:
+                self.assertFalse(any('<img' in str(cell) for cell in row), row)
+
+class GPSTest(CruiseTestCase):
+
+    def test_decimal_degrees(self):
+        timestamp = datetime(2019, 1, 2, tzinfo=pytz.utc)
+        for degree, minute, expected in ((21, 18, 21.3), (-157, 54, -157.9), (0, 30, 0.5), (0, -30, -0.5), (-1, 30, -1.5)):
+            gps = GPS(latitude_degree=degree, latitude_minute=minute, timestamp=timestamp)
+            gps.set_decimal_degrees()
+            self.assertAlmostEqual(gps.latitude, expected)
+        self.assertIsNone(GPS.get_empty().latitude)
+
+    def test_dedupe_gps(self):
+        unlocated = [GPS.objects.create(timestamp=None) for i in range(3)]
+        fix = GPS.objects.create(timestamp=None, latitude_degree=21, latitude_minute=18)
+        for minutes, gps in enumerate(unlocated + [GPS.get_empty(), fix]):
+            ShipLog.objects.create(cruise=self.cruise, device=self.device, event=self.deploy, gps=gps, timestamp=self.start + timedelta(minutes=minutes))
+        call_command('dedupe_gps', stdout=open(os.devnull, 'w'))
+        self.assertEqual(GPS.objects.filter(timestamp=None).count(), 1)
+        empty = GPS.get_empty()
+        self.assertEqual(ShipLog.objects.filter(gps=empty).count(), 4)
+        self.assertEqual(set(GPS.objects.values_list('id', flat=True)), {empty.id, fix.id})
+
+    def test_dedupe_gps_without_empty_row(self):
+        unlocated = [GPS.objects.create(timestamp=None) for i in range(2)]
+        call_command('dedupe_gps', stdout=open(os.devnull, 'w'))
+        self.assertEqual(list(GPS.objects.values_list('id', 'timestamp')), [(unlocated[0].id, GPS.get_empty().timestamp)])
+
+def has_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+@override_settings(ARCHIVE_CRUISES=True)
+class ArchiveTest(CruiseTestCase):
+    device_name = 'Net'
+    winch = 0  # over the side by hand
+    end_date = datetime(2019, 1, 3, tzinfo=pytz.utc)
+
+    def setUp(self):
+        super().setUp()
+        self.log_cast()
+        self.directory = self.use_directory('ARCHIVE_PATH', GPS_FILENAME='nav.dat', GPS_ARCHIVE_PATH='nav_*.dat', WINCH_DATAFILE_PATH='*WinchDAC.csv')
+
+    @unittest.skipUnless(has_pyarrow(), 'archival needs pyarrow')
+    def test_snapshot_has_casts_without_winch(self):
+        self.cruise.archive()
+        self.assertEqual(len(archive.read(self.cruise.id, 'wirelog')), CastReport.get_all_logs().count())
+        self.assertEqual(len(archive.read(self.cruise.id, 'eventlog')), 2)
+
+    @unittest.skipUnless(has_pyarrow(), 'archival needs pyarrow')
+    def test_all_export_stays_in_cruise_order(self):
+        self.cruise.archive()
+        for number, start in (('TC00', datetime(2018, 12, 1, tzinfo=pytz.utc)), ('TC02', datetime(2019, 2, 1, tzinfo=pytz.utc))):
+            cruise = Cruise.objects.create(name='Cruise ' + number, number=number, start_date=start, end_date=start + timedelta(days=2))
+            ShipLog.objects.create(cruise=cruise, device=self.device, event=self.deploy, gps=GPS.get_empty(), timestamp=start + timedelta(days=1))
+        with self.settings(EXPORT_CACHE_PATH=self.directory):
+            response = self.client.get('/download/eventlog/0/')
+            df = pd.read_csv(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(list(df['Date']), ['2018-12-02', '2019-01-02', '2019-01-02', '2019-02-02'])
+
+    @unittest.skipUnless(has_pyarrow(), 'archival needs pyarrow')
+    def test_version_1_snapshot(self):
+        snapshot = archive.Snapshot(self.cruise.id)
+        fields = [field for field in ShipLog.export_fields if field not in ('gps__latitude', 'gps__longitude')]
+        rows = [(datetime(2019, 1, 2, tzinfo=pytz.utc), 'Net', 'Deploy', 0, -30.0, -157, 54.0), (datetime(2019, 1, 2, 0, 40, tzinfo=pytz.utc), 'Net', 'Recover', 0, 0.0, 0, 0.0)]
+        snapshot.write('eventlog', pd.DataFrame.from_records(rows, columns=fields))
+        snapshot.close()
+        Cruise.objects.filter(pk=self.cruise.pk).update(archived=datetime.now(pytz.utc) + timedelta(seconds=1))
+        with self.settings(EXPORT_CACHE_PATH=self.directory):
+            response = self.client.get('/download/eventlog/0/', {'format': 'parquet'})
+            df = pd.read_parquet(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(list(df['Latitude'].round(6).fillna(99)), [-0.5, 99])
+        self.assertEqual(list(df['Longitude'].round(6).fillna(99)), [-157.9, 99])
+
+    def test_changed_rows_are_exported_live(self):
+        Cruise.objects.filter(pk=self.cruise.pk).update(archived=datetime.now(pytz.utc))
+        log, filename, archived = utils.get_log(CastReport, 0, '{}.csv')
+        self.assertEqual((log.count(), archived), (0, [self.cruise]))
+        etag = utils.get_export_version('wirelog', 0, log, archived)[0]
+        CastReport.objects.update(max_tension=1000, modified=datetime.now(pytz.utc) + timedelta(seconds=1))
+        log, filename, archived = utils.get_log(CastReport, 0, '{}.csv')
+        self.assertEqual((log.count(), archived), (1, []))
+        self.assertNotEqual(utils.get_export_version('wirelog', 0, log, archived)[0], etag)
+        log, filename, archived = utils.get_log(ShipLog, 0, '{}.csv')
+        self.assertEqual((log.count(), archived), (0, [self.cruise]))
+
+class WinchRollupTest(CruiseTestCase):
+
+    def samples(self, seconds, tension):
+        return pd.DataFrame({
+            'Date': pd.Timestamp('2019-01-02') + pd.to_timedelta(seconds, unit='s'),
+            'Tension': tension,
+            'Speed': 1.0,
+            'Payout': 2.0,
+        })
+
+    def test_gap_inside_the_cast_falls_back_to_the_files(self):
+        seconds = np.r_[0:600, 1200:1800]  # the ingester was down for 10 minutes
+        WinchRollup.add(2, self.samples(seconds, 1000.0))
+        self.assertIsNone(WinchRollup.get_cast_stats(2, self.start, self.start + timedelta(seconds=1799)))
+        self.assertIsNotNone(WinchRollup.get_cast_stats(2, self.start + timedelta(seconds=1200), self.start + timedelta(seconds=1799)))
+
+    def test_mean_tension_skips_missing_samples(self):
+        tension = np.where(np.arange(600) % 2, np.nan, 1000.0)  # every other sample has no tension
+        tension[:60] = 2000.0
+        WinchRollup.add(2, self.samples(np.arange(330), tension[:330]))
+        WinchRollup.add(2, self.samples(np.arange(330, 600), tension[330:]))  # merged into the bucket already stored
+        stats = WinchRollup.get_cast_stats(2, self.start, self.start + timedelta(seconds=599))
+        self.assertAlmostEqual(stats.mean_tension, np.nanmean(tension))
+
+    def test_is_behind(self):
+        WinchRollup.add(2, self.samples(np.arange(600), 1000.0))
+        self.assertFalse(WinchRollup.is_behind(2, self.start + timedelta(seconds=599.5)))
+        self.assertTrue(WinchRollup.is_behind(2, self.start + timedelta(seconds=600)))
+        self.assertFalse(WinchRollup.is_behind(3, self.start + timedelta(seconds=600)))  # not rolled up at all
+
+    def recover_queued(self):
+        with self.settings(ASYNC=True):  # analyze_cast is queued once the transaction commits, which a TestCase never does
+            deployment, recovery = self.log_cast()
+        self.assertFalse(Cast.objects.exists())
+        return recovery
+
+    def test_analyze_cast_waits_for_the_rollups(self):
+        recovery = self.recover_queued()
+        with mock.patch.object(WinchRollup, 'is_behind', side_effect=[True, True, False]) as is_behind:
+            analyze_cast.apply(args=(recovery.id,))
+        self.assertEqual(is_behind.call_count, 3)
+        self.assertEqual(Cast.objects.get().recovery, recovery)
+
+    def test_analyze_cast_falls_back_to_the_files(self):
+        recovery = self.recover_queued()
+        with self.settings(WINCH_DATAFILE_PATH=os.path.join(self.use_directory(), '*WinchDAC.csv')):
+            with mock.patch.object(WinchRollup, 'is_behind', return_value=True) as is_behind:
+                analyze_cast.apply(args=(recovery.id,))
+        self.assertEqual(is_behind.call_count, analyze_cast.max_retries + 1)
+        self.assertEqual(Cast.objects.get().recovery, recovery)
+
+@override_settings(IMPORT_TOKEN='bridge-token')
+class ImportTest(CruiseTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = self.use_directory(GPS_FILENAME='MainMetMast_Nav.dat')
+        with open(os.path.join(directory, 'MainMetMast_Nav.dat'), 'w') as f:
+            f.write(NAV_HEADER + ''.join(nav_line(self.start + timedelta(seconds=10 * i), i, 18.0 + i) for i in range(6)))
+
+    def import_csv(self, text):
+        return ShipLog.import_events(self.cruise, utils.read_import(text.encode()))
+
+    def test_invalid_lines_are_reported_and_nothing_is_logged(self):
+        result = self.import_csv(
+            'timestamp,device,event\n'
+            '2019-01-02 00:00:00,CTD,Deploy\n'
+            'yesterday,CTD,Deploy\n'
+            '2019-01-02 00:00:10,Rosette,Deploy\n'
+            '2019-01-02 00:00:20,CTD,Launch\n'
+        )
+        self.assertEqual(result.errors, [
+            'Line 3: unreadable timestamp',
+            'Line 4: Rosette is not configured for {}'.format(self.cruise),
+            'Line 5: CTD has no Launch event',
+        ])
+        self.assertFalse(ShipLog.objects.exists())
+        self.assertEqual(self.import_csv('time,device\n')[2], ['Missing columns: timestamp, event'])
+
+    def test_duplicates_are_skipped(self):
+        text = 'timestamp,device,event\n2019-01-02 00:00:00,CTD,Deploy\n2019-01-02 00:00:00,CTD,Deploy\n2019-01-02 00:40:00,CTD,Recover\n'
+        first = self.import_csv(text)
+        self.assertEqual((len(first.shiplogs), first.duplicates), (2, 1))
+        second = self.import_csv(text)
+        self.assertEqual((len(second.shiplogs), second.duplicates), (0, 3))
+        self.assertEqual(ShipLog.objects.count(), 2)
+        self.assertEqual(Cast.objects.count(), 1)  # the imported recovery was analyzed
+
+    def test_events_get_the_nearest_fix_within_tolerance(self):
+        self.import_csv(
+            'timestamp,device,event\n'
+            '2019-01-02 00:00:04,CTD,Deploy\n'
+            '2019-01-02 00:00:26,CTD,Recover\n'
+            '2019-01-02 00:00:49,CTD,Deploy\n'
+            '2019-01-02 00:01:21,CTD,Recover\n'
+        )
+        shiplogs = list(ShipLog.objects.select_related('gps').order_by('timestamp'))
+        self.assertEqual([s.gps.latitude_minute for s in shiplogs[:3]], [18, 21, 23])  # fixes at :00, :30 and :50
+        self.assertEqual(shiplogs[2].gps.timestamp, self.start + timedelta(seconds=50))
+        self.assertEqual(shiplogs[3].gps_id, GPS.get_empty().id)  # 31 s past the last fix
+        self.assertEqual(GPS.objects.count(), 4)
+
+    def test_import_needs_staff_or_the_token(self):
+        body = 'timestamp,device,event\n2019-01-02 00:00:00,CTD,Deploy\n'
+        post = lambda **headers: self.client.post('/eventlog/import/', body, content_type='text/csv', **headers)
+        self.assertEqual(post().status_code, 403)
+        self.assertEqual(post(HTTP_AUTHORIZATION='Token wrong').status_code, 403)
+        self.client.force_login(User.objects.create_user('deckhand', password='p'))
+        self.assertEqual(post().status_code, 403)
+        self.assertFalse(ShipLog.objects.exists())
+        self.client.logout()
+        self.assertEqual(post(HTTP_AUTHORIZATION='Token bridge-token').json()['imported'], 1)
+        self.client.force_login(User.objects.create_user('mate', password='p', is_staff=True))
+        self.assertEqual(post().json()['duplicates'], 1)
+        browser = Client(enforce_csrf_checks=True)
+        browser.force_login(User.objects.get(username='mate'))
+        self.assertEqual(browser.post('/eventlog/import/', body, content_type='text/csv').status_code, 403)  # no CSRF token
+
+class WireUsageTest(CruiseTestCase):
+    serial_number = 'W1'
+
+    def setUp(self):
+        super().setUp()
+        self.directory = self.use_directory(WINCH_DATAFILE_PATH='*WinchDAC.csv')  # no winch files, only rollups
+
+    def cast(self, seconds):
+        self.log_cast(seconds)
+        return Cast.objects.get()
+
+    def test_usage_from_rollups(self):
+        seconds = np.arange(1800)
+        WinchRollup.add(2, pd.DataFrame({
+            'Date': pd.Timestamp('2019-01-02') + pd.to_timedelta(seconds, unit='s'),
+            'Tension': 1000 + 500 * np.sin(2 * np.pi * seconds / 60),
+            'Speed': 30.0,
+            'Payout': 0.5 * np.minimum(seconds, 1799 - seconds),
+        }))
+        usage = self.cast(1799).wire_usage
+        self.assertEqual(usage.samples, 1800)
+        self.assertAlmostEqual(usage.meters_out, 449.5)
+        self.assertAlmostEqual(usage.meters_in, 449.5)
+        self.assertAlmostEqual(usage.cycles, 30, delta=1)
+
+    def test_reanalyze_records_usage(self):
+        write_winch_file(self.directory, datetime(2019, 1, 2))
+        with self.settings(WINCH_CACHE_PATH=os.path.join(self.directory, 'cache')):
+            cast = self.cast(3600)
+            fields = ['samples', 'seconds', 'meters_out', 'meters_in', 'cycles', 'damage']
+            measured = WireUsage.objects.values_list(*fields).get(cast=cast)
+            WireUsage.objects.all().delete()
+            call_command('reanalyze_casts', processes=1, stdout=open(os.devnull, 'w'))
+        self.assertEqual(WireUsage.objects.values_list(*fields).get(cast=cast), measured)
+
+    def test_no_winch_data_records_no_usage(self):
+        cast = self.cast(1799)
+        self.assertEqual(CastReport.objects.get(cast=cast).max_tension, None)
+        self.assertFalse(WireUsage.objects.filter(cast=cast).exists())
+
+@override_settings(ARCHIVE_CRUISES=False, ACTIVE_CRUISE_TIMEOUT=60)
+class ActiveCruiseTest(CruiseTestCase):
+    def cached_for(self):
+        """The active cruise and the seconds it is cached for"""
+        with mock.patch('eventcapture.models.cache') as cache:
+            cache.get.return_value = None
+            cruise = Cruise.get_active_cruise()
+        key, value, timeout = cache.set.call_args[0]
+        self.assertEqual(value, (cruise, ))
+        return cruise, timeout
+
+    def test_cached_for_the_timeout(self):
+        self.assertEqual(self.cached_for(), (self.cruise, 60))
+
+    def test_not_cached_past_the_end_of_the_cruise(self):
+        self.cruise.end_date = datetime.now(pytz.utc) + timedelta(seconds=20)
+        self.cruise.save()
+        cruise, timeout = self.cached_for()
+        self.assertEqual(cruise, self.cruise)
+        self.assertIn(timeout, (19, 20))
+
+    def test_not_cached_past_the_start_of_the_next_cruise(self):
+        Cruise.objects.create(name='Next Cruise', number='TC02', start_date=datetime.now(pytz.utc) + timedelta(seconds=30))
+        cruise, timeout = self.cached_for()
+        self.assertEqual(cruise, self.cruise)
+        self.assertIn(timeout, (29, 30))
+        self.cruise.end_date = datetime.now(pytz.utc) - timedelta(days=1)
+        self.cruise.save()
+        cruise, timeout = self.cached_for()
+        self.assertIsNone(cruise)  # between cruises until the next one starts
+        self.assertIn(timeout, (29, 30))
+
+    def test_saving_a_cruise_clears_the_cache(self):
+        self.assertEqual(Cruise.get_active_cruise(), self.cruise)
+        Cruise.objects.filter(pk=self.cruise.pk).update(end_date=datetime.now(pytz.utc) - timedelta(days=1))
+        self.assertEqual(Cruise.get_active_cruise(), self.cruise)  # an update skips save, so the answer is still cached
+        self.cruise.refresh_from_db()
+        self.cruise.save()
+        self.assertIsNone(Cruise.get_active_cruise())
+        started = Cruise.objects.create(name='Next Cruise', number='TC02', start_date=datetime.now(pytz.utc) - timedelta(minutes=1))
+        self.assertEqual(Cruise.get_active_cruise(), started)
+
+    def test_ending_the_cruise_in_admin_clears_the_cache(self):
+        self.client.force_login(User.objects.create_superuser('captain', 'captain@example.com', 'password'))
+        self.assertEqual(Cruise.get_active_cruise(), self.cruise)
+        response = self.client.post('/admin/eventcapture/cruise/{}/change/'.format(self.cruise.id), {
+            'start_date_0': '2019-01-01',
+            'start_date_1': '00:00:00',
+            'name': self.cruise.name,
+            'number': self.cruise.number,
+            'config': [self.config.id],
+            'end_cruise': 'End cruise',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIsNotNone(Cruise.objects.get(pk=self.cruise.pk).end_date)
+        self.assertIsNone(Cruise.get_active_cruise())
+
+class PairingTest(CruiseTestCase):
+    def cast_pairs(self):
+        return list(Cast.objects.order_by('recovery__timestamp').values_list('deployment_id', 'recovery_id'))
+
+    def test_back_to_back_casts(self):
+        first = self.log(self.deploy), self.log(self.recover, minutes=40)
+        second = self.log(self.deploy, minutes=40, seconds=1), self.log(self.recover, minutes=80)
+        expected = [(first[0].id, first[1].id), (second[0].id, second[1].id)]
+        self.assertEqual(self.cast_pairs(), expected)
+        pairing = ShipLog.pair_events(self.cruise)
+        self.assertEqual([(d.id, r.id) for d, r in pairing.pairs], expected)
+        self.assertEqual(pairing.orphan_deployments + pairing.orphan_recoveries + pairing.double_deployments, [])
+
+    def test_recover_without_deploy(self):
+        orphan = self.log(self.recover)
+        self.assertEqual(self.cast_pairs(), [])
+        self.assertEqual(ShipLog.pair_events(self.cruise).orphan_recoveries, [orphan])
+
+    def test_second_recover_does_not_reuse_a_recovered_deploy(self):
+        deployment, recovery = self.log(self.deploy), self.log(self.recover, minutes=40)
+        orphan = self.log(self.recover, minutes=80)
+        self.assertIsNone(orphan.find_deployment())
+        self.assertEqual(self.cast_pairs(), [(deployment.id, recovery.id)])
+        self.assertEqual(ShipLog.pair_events(self.cruise).orphan_recoveries, [orphan])
+
+    def test_deploy_and_recover_in_the_same_second(self):
+        deployment, recovery = self.log(self.deploy), self.log(self.recover)
+        self.assertEqual(recovery.find_deployment(), deployment)
+        self.assertEqual(self.cast_pairs(), [(deployment.id, recovery.id)])
+        self.assertEqual([(d.id, r.id) for d, r in ShipLog.pair_events(self.cruise).pairs], [(deployment.id, recovery.id)])
+
+NAV_HEADER = (
+    '"TOA5","MainMetMast","CR1000","1234","CR1000.Std.32","CPU:MainMetMast.CR1","1234","Nav"\n'
+    '"TIMESTAMP","RECORD","Lat_deg","Lat_min","Lon_deg","Lon_min"\n'
+    '"TS","RN","degrees","minutes","degrees","minutes"\n'
+    '"","","Smp","Smp","Smp","Smp"\n'
+)
+
+def nav_line(timestamp, record, latitude_minute=18.0):
+    return '"{:%Y-%m-%d %H:%M:%S}",{},21,{},-157,54.0\n'.format(timestamp, record, latitude_minute)
+
+class NavReaderTest(TemporaryDirectoryMixin, SimpleTestCase):
+    start = datetime(2019, 1, 2, tzinfo=pytz.utc)
+
+    def setUp(self):
+        self.path = os.path.join(self.use_directory(), 'MainMetMast_Nav.dat')
+        self.reader = nav.NavReader(self.path)
+
+    def write(self, text, mode='a'):
+        with open(self.path, mode) as f:
+            f.write(text)
+
+    def test_appended_rows_are_parsed_once_complete(self):
+        self.write(NAV_HEADER[:40], 'w')
+        self.assertTrue(self.reader.refresh().fixes.empty)  # the header is still being written
+        self.write(NAV_HEADER[40:] + nav_line(self.start, 0))
+        self.assertEqual(len(self.reader.refresh().fixes), 1)
+        line = nav_line(self.start + timedelta(seconds=10), 1)
+        self.write(line[:20])
+        self.assertEqual(len(self.reader.refresh().fixes), 1)  # never parse a partially written line
+        self.write(line[20:])
+        self.assertEqual(self.reader.refresh().last_timestamp, self.start + timedelta(seconds=10))
+
+    def test_nearest_within_tolerance(self):
+        self.write(NAV_HEADER + nav_line(self.start, 0, 18.0) + nav_line(self.start + timedelta(seconds=60), 1, 19.0), 'w')
+        reader = self.reader.refresh()
+        self.assertEqual(reader.nearest(self.start + timedelta(seconds=29))['Lat_min'], 18.0)
+        self.assertEqual(reader.nearest(self.start + timedelta(seconds=31))['Lat_min'], 19.0)
+        self.assertEqual(reader.nearest(self.start - nav.TOLERANCE)['Lat_min'], 18.0)
+        self.assertIsNone(reader.nearest(self.start - nav.TOLERANCE - timedelta(seconds=1)))
+        self.assertIsNone(reader.nearest(self.start + timedelta(seconds=91)))
+
+    def test_rotated_file_is_read_from_the_start(self):
+        self.write(NAV_HEADER + nav_line(self.start, 0), 'w')
+        self.reader.refresh()
+        rotated = self.path + '.new'
+        with open(rotated, 'w') as f:
+            f.write(NAV_HEADER + nav_line(self.start + timedelta(days=1), 0) + nav_line(self.start + timedelta(days=1, seconds=10), 1))
+        os.replace(rotated, self.path)
+        fixes = self.reader.refresh().fixes
+        self.assertEqual(len(fixes), 2)
+        self.assertEqual(fixes.index[0], self.start + timedelta(days=1))
+
+    def test_truncated_file_is_read_from_the_start(self):
+        self.write(NAV_HEADER + ''.join(nav_line(self.start + timedelta(seconds=10 * i), i) for i in range(5)), 'w')
+        self.assertEqual(len(self.reader.refresh().fixes), 5)
+        self.write(NAV_HEADER + nav_line(self.start + timedelta(days=1), 0), 'w')
+        fixes = self.reader.refresh().fixes
+        self.assertEqual(len(fixes), 1)
+        self.assertIsNone(self.reader.nearest(self.start))
+
+def winch_text(start, rows):
+    """A WinchDAC file of rows logged 1 s apart from start"""
+    lines = ['LCI-90i metadata line {}\n'.format(i) for i in range(winch.HEADER_LINES - 2)]
+    lines += [','.join(winch.COLUMNS) + '\n', 's,clock,lbs,m/min,m,lbs,m/min,m,lbs,m/min,m\n']
+    for i, timestamp in enumerate(pd.date_range(start, periods=rows, freq='S')):
+        values = ['{:.1f}'.format(1000 * w + c + i % 97) for w in winch.WINCHES for c in range(len(winch.CHANNELS))]
+        lines.append(','.join([str(i), timestamp.strftime(winch.CLOCK_FORMAT)] + values) + '\n')
+    return ''.join(lines).encode()
+
+@override_settings(WINCH_INDEX_INTERVAL=7)
+class WinchFileTest(TemporaryDirectoryMixin, SimpleTestCase):
+    start = datetime(2019, 1, 2)
+
+    def setUp(self):
+        self.directory = self.use_directory(WINCH_CACHE_PATH='cache')
+        self.path = os.path.join(self.directory, self.start.strftime(winch.FILENAME_FORMAT))
+
+    def write(self, data, mode='ab'):
+        with open(self.path, mode) as f:
+            f.write(data)
+
+    def parse(self, data):
+        """What a fresh parse of data sees, only its complete rows"""
+        rows = data[:data.rfind(b'\n') + 1].split(b'\n', winch.HEADER_LINES)[-1] if data.count(b'\n') >= winch.HEADER_LINES else b''
+        df = pd.read_csv(io.BytesIO(rows), header=None, names=winch.COLUMNS) if rows else pd.DataFrame(columns=winch.COLUMNS)
+        df['Date'] = pd.to_datetime(df['Date'], format=winch.CLOCK_FORMAT)
+        return df.astype({c: float for c in winch.COLUMNS if c != 'Date'})
+
+    def assert_matches(self, data, start, end):
+        expected = self.parse(data)
+        current = winch.WinchFile(self.path, is_current=True)
+        pd.testing.assert_frame_equal(current.load().astype({'Seconds': float}), expected, check_dtype=False)
+        chunks = list(current.iter_range(start, end, 2, chunksize=5))
+        got = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=['Date'] + winch.CHANNELS)
+        window = expected[(expected['Date'] >= start) & (expected['Date'] <= end)][['Date'] + winch.winch_columns(2)]
+        window.columns = ['Date'] + winch.CHANNELS
+        pd.testing.assert_frame_equal(got.reset_index(drop=True), window.reset_index(drop=True), check_dtype=False)
+        with self.settings(WINCH_CACHE_PATH=os.path.join(self.directory, 'fresh_{}'.format(len(data)))):
+            fresh = winch.WinchFile(self.path, is_current=True).index()
+        for incremental, rebuilt in zip(current.index(), fresh):
+            np.testing.assert_array_equal(incremental, rebuilt)
+
+    def test_growing_file_matches_a_fresh_parse(self):
+        data = winch_text(self.start, 200)
+        cuts = np.sort(np.random.RandomState(4).choice(len(data), 25, replace=False)).tolist() + [len(data)]
+        written = 0
+        for cut in cuts:
+            self.write(data[written:cut])
+            written = cut
+            offset = int(cut) % 180
+            self.assert_matches(data[:cut], self.start + timedelta(seconds=offset), self.start + timedelta(seconds=offset + 30))
+
+    def test_truncated_and_rewritten_file(self):
+        data = winch_text(self.start, 150)
+        self.write(data)
+        self.assert_matches(data, self.start, self.start + timedelta(seconds=149))
+        data = data[:len(data) // 2]
+        self.write(data, 'wb')  # truncated
+        self.assert_matches(data, self.start + timedelta(seconds=10), self.start + timedelta(seconds=60))
+        data = winch_text(self.start + timedelta(hours=1), 200)
+        self.write(data, 'wb')  # rewritten, longer than before
+        self.assert_matches(data, self.start + timedelta(hours=1, seconds=20), self.start + timedelta(hours=1, seconds=90))
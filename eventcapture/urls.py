@@ -7,5 +7,10 @@ urlpatterns = [
     url(r'^event/(?P<device_id>[0-9]+)/$', views.event, name='event'),
     url(r'^download/(?P<log>[a-z]+)/(?P<cruise_id>[0-9]+)/$', views.download, name='download'),
     url(r'^eventlog/$', views.eventlog, name='eventlog'),
+    url(r'^eventlog/data/$', views.eventlog_data, name='eventlog_data'),
+    url(r'^eventlog/import/$', views.import_events, name='import_events'),
     url(r'^wirelog/$', views.wirelog, name='wirelog'),
+    url(r'^wirelog/data/$', views.wirelog_data, name='wirelog_data'),
+    url(r'^cast/(?P<cast_report_id>[0-9]+)/$', views.cast, name='cast'),
+    url(r'^cast/(?P<cast_report_id>[0-9]+)/profile/$', views.cast_profile, name='cast_profile'),
 ]
@@ -1,8 +1,19 @@
+import io
 import os
+import json
+import hashlib
+import tempfile
+from glob import glob
+from itertools import chain, islice
+import pandas as pd
 from django.conf import settings
+from django.db.models import Count, Max
+from eventcapture import archive, formats
 from eventcapture.models import Cruise
 
-def to_csv(cls, cruise_id, filename):
+def get_log(cls, cruise_id, filename):
+    """Live log of a cruise, or of all cruises with the archived ones left to their snapshots"""
+    archived = []
     try:
         cruise = Cruise.objects.get(pk=cruise_id)
     except Cruise.DoesNotExist:
@@ -13,10 +24,128 @@ def to_csv(cls, cruise_id, filename):
     else:
         cruise_number = 'All'
         log = cls.get_all_logs()
-    filename = filename.format(cruise_number)
-    df = cls._to_df(log)
-    root_path = os.path.dirname(__file__)
-    outfile = os.path.join(root_path, os.pardir, 'media', filename)
-    df.to_csv(outfile)
-    return outfile
+        if settings.ARCHIVE_CRUISES:
+            archived = get_current_snapshots(cls)
+            log = log.exclude(**{cls.cruise_field + '__in': archived})
+    return log, filename.format(cruise_number), archived
 
+def get_current_snapshots(cls):
+    """Archived cruises none of whose rows changed since their snapshot, the others are exported live until archived again"""
+    archived = list(Cruise.objects.filter(archived__isnull=False).order_by('start_date'))
+    changed = cls.objects.filter(**{cls.cruise_field + '__in': archived}).order_by().values_list(cls.cruise_field).annotate(Max('modified'))
+    changed = dict(changed)
+    return [cruise for cruise in archived if cruise.id not in changed or changed[cruise.id] <= cruise.archived]
+
+def iter_records(cls, log):
+    """Export fields of a live log, EXPORT_CHUNK_ROWS rows at a time"""
+    rows = log.values_list(*cls.export_fields).iterator(chunk_size=settings.EXPORT_CHUNK_ROWS)
+    while True:
+        chunk = list(islice(rows, settings.EXPORT_CHUNK_ROWS))
+        if not chunk:
+            return
+        yield pd.DataFrame.from_records(chunk, columns=cls.export_fields)
+
+def iter_archived(name, archived):
+    """Export fields of the snapshots of archived cruises, EXPORT_CHUNK_ROWS rows at a time"""
+    for cruise in archived:
+        df = archive.read(cruise.id, name)
+        for start in range(0, len(df), settings.EXPORT_CHUNK_ROWS):
+            yield df.iloc[start:start + settings.EXPORT_CHUNK_ROWS].reset_index(drop=True)
+
+def iter_frames(cls, log, name=None, archived=()):
+    """Export fields cruise by cruise in start_date order, an archived cruise from its snapshot and the others from the live log"""
+    if not archived:
+        return iter_records(cls, log)
+    frames = []
+    for cruise in Cruise.objects.order_by('start_date'):
+        if cruise in archived:
+            frames.append(iter_archived(name, [cruise]))
+        else:
+            frames.append(iter_records(cls, log.filter(**{cls.cruise_field: cruise})))
+    return chain.from_iterable(frames)
+
+def iter_csv(cls, log, name=None, archived=()):
+    """CSV text of the archived cruises then a live log, formatted and yielded EXPORT_CHUNK_ROWS rows at a time"""
+    offset = 0
+    for df in iter_frames(cls, log, name, archived):
+        df = cls._format_df(df)
+        df.index = range(offset, offset + len(df))
+        yield df.to_csv(header=offset == 0)
+        offset += len(df)
+    if not offset:
+        yield cls._format_df(pd.DataFrame.from_records([], columns=cls.export_fields)).to_csv()
+
+def iter_export(cls, log, fmt, name=None, archived=()):
+    """Bytes of a log download in fmt, the columnar formats keep typed columns and get a row group per chunk"""
+    if fmt == 'csv':
+        return (chunk.encode() for chunk in iter_csv(cls, log, name, archived))
+    if fmt == 'csv.gz':
+        return formats.iter_gzip(iter_csv(cls, log, name, archived))
+    frames = (cls._typed_df(df) for df in iter_frames(cls, log, name, archived))
+    empty = cls._typed_df(pd.DataFrame.from_records([], columns=cls.export_fields))
+    return formats.iter_columnar(frames, fmt, empty)
+
+def get_export_version(name, cruise_id, log, archived=(), fmt='csv'):
+    """ETag and last change of a log, any saved, added or deleted row or new snapshot changes them"""
+    marker = log.aggregate(count=Count('id'), modified=Max('modified'))
+    snapshots = ','.join('{}@{}'.format(cruise.id, cruise.archived) for cruise in archived)
+    version = '{}:{}:{}:{}:{}:{}'.format(name, cruise_id, fmt, marker['count'], marker['modified'], snapshots)
+    modified = max(filter(None, [marker['modified']] + [cruise.archived for cruise in archived]), default=None)
+    return '"{}"'.format(hashlib.md5(version.encode()).hexdigest()), modified
+
+def get_export_path(name, cruise_id, etag, fmt='csv'):
+    return os.path.join(settings.EXPORT_CACHE_PATH, '{}_{}_{}{}'.format(name, cruise_id, etag.strip('"'), formats.FORMATS[fmt][1]))
+
+def cache_as_streamed(chunks, path):
+    """Pass chunks of bytes through while saving them to path, the file only appears once the export is complete"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    f = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.tmp', delete=False)
+    try:
+        for chunk in chunks:
+            f.write(chunk)
+            yield chunk
+        f.close()
+        prefix, etag_extension = path.rsplit('_', 1)
+        stale = glob(prefix + '_*' + etag_extension[etag_extension.index('.'):])
+        os.replace(f.name, path)
+        for old in stale:
+            if old != path:
+                os.remove(old)
+    finally:
+        if not f.closed:
+            # the download was interrupted, drop the partial export
+            f.close()
+            os.remove(f.name)
+
+def get_int(params, name, default=0):
+    try:
+        return int(params.get(name, default))
+    except ValueError:
+        return default
+
+def get_datatable_page(request, log, columns):
+    """Order and slice a log for a DataTables server-side processing request"""
+    column = columns[min(max(get_int(request.GET, 'order[0][column]'), 0), len(columns) - 1)]
+    if request.GET.get('order[0][dir]') == 'desc':
+        column = '-' + column
+    start = max(get_int(request.GET, 'start'), 0)
+    length = get_int(request.GET, 'length', settings.DATATABLE_PAGE_LENGTH)
+    if not 0 < length <= settings.DATATABLE_PAGE_LENGTH:
+        length = settings.DATATABLE_PAGE_LENGTH  # "All" is not an option on the bridge terminals
+    return log.order_by(column, 'id')[start:start + length]
+
+def get_datatable_response(request, total, filtered, rows):
+    return {
+        'draw': get_int(request.GET, 'draw'),
+        'recordsTotal': total,
+        'recordsFiltered': filtered,
+        'data': rows,
+    }
+
+def read_import(data, content_type='text/csv'):
+    """Events to import from a CSV file or a JSON list of objects, with timestamp, device and event of each"""
+    if content_type == 'application/json':
+        return pd.DataFrame(json.loads(data.decode() if isinstance(data, bytes) else data), dtype=str)
+    if isinstance(data, bytes):
+        data = io.BytesIO(data)
+    return pd.read_csv(data, dtype=str, skipinitialspace=True)
@@ -1,12 +1,21 @@
 import os
 import pytz
 from datetime import datetime
-from django.shortcuts import render
-from django.http import HttpResponseRedirect, HttpResponse
+from django.shortcuts import render, get_object_or_404
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, StreamingHttpResponse, FileResponse, JsonResponse
+from django.template.defaultfilters import date
+from django.utils.html import escape, format_html
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.conf import settings
-from eventcapture import utils
-from eventcapture.models import Cruise, Device, Event, ShipLog, Cast, CastReport, GPS
+from eventcapture import formats, utils
+from eventcapture.models import Cruise, Device, Event, ShipLog, Cast, CastReport
 
 def index(request):
     context = {}
@@ -29,9 +38,7 @@ def index(request):
     device = Device.objects.get(pk=int(device_id))
     event = Event.objects.get(pk=int(event_id))
     timestamp = datetime.now(pytz.utc)
-    gps = GPS()
-    gps.save(timestamp=timestamp)
-    shiplog = ShipLog(cruise=cruise, device=device, event=event, gps=gps, timestamp=timestamp)
+    shiplog = ShipLog(cruise=cruise, device=device, event=event, timestamp=timestamp)
     shiplog.save()
     context['event_was_logged'] = True
     return render(request, 'index.html', context)
@@ -59,15 +66,36 @@ def event(request, device_id):
 
 def download(request, log, cruise_id):
     if log == 'eventlog':
-        csv_path = utils.to_csv(ShipLog, cruise_id, settings.EVENT_LOG_FILENAME)
+        cls, filename = ShipLog, settings.EVENT_LOG_FILENAME
     elif log == 'wirelog':
-        csv_path = utils.to_csv(CastReport, cruise_id, settings.WIRE_LOG_FILENAME)
+        cls, filename = CastReport, settings.WIRE_LOG_FILENAME
     else:
         raise ValueError('Unknown log type')
-    with open(csv_path, 'rb') as f:
-        response = HttpResponse(f.read(), content_type='text/csv')
-        response['Content-Disposition'] = 'inline; filename=' + os.path.basename(csv_path)
-        return response
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in formats.FORMATS:
+        return HttpResponseBadRequest('Unknown format, one of {}'.format(', '.join(formats.FORMATS)))
+    if fmt in formats.COLUMNAR:
+        try:
+            formats.get_pyarrow()
+        except ImproperlyConfigured as e:
+            return HttpResponse(str(e), status=501)
+    queryset, filename, archived = utils.get_log(cls, cruise_id, filename)
+    etag, last_modified = utils.get_export_version(log, cruise_id, queryset, archived, fmt)
+    last_modified = last_modified and int(last_modified.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        path = utils.get_export_path(log, cruise_id, etag, fmt)
+        content_type = formats.get_content_type(fmt)
+        if os.path.isfile(path):
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        else:
+            response = StreamingHttpResponse(utils.cache_as_streamed(utils.iter_export(cls, queryset, fmt, log, archived), path), content_type=content_type)
+        disposition = 'inline' if fmt == 'csv' else 'attachment'
+        response['Content-Disposition'] = '{}; filename={}'.format(disposition, formats.get_filename(filename, fmt))
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
 
 def eventlog(request):
     try:
@@ -82,7 +110,9 @@ def eventlog(request):
         return render(request, 'eventlog.html', context)
     action = request.POST.get('action', None)
     if action == 'download':
-        return HttpResponseRedirect(reverse('download', args=['eventlog', cruise.id]))
+        url = reverse('download', args=['eventlog', cruise.id])
+        fmt = request.POST.get('format', 'csv')
+        return HttpResponseRedirect(url if fmt == 'csv' else '{}?format={}'.format(url, fmt))
 
 def wirelog(request):
     cruise = Cruise.get_active_cruise()
@@ -94,5 +124,94 @@ def wirelog(request):
         return render(request, 'wirelog.html', context)
     action = request.POST.get('action', None)
     if action == 'download':
-        return HttpResponseRedirect(reverse('download', args=['wirelog', cruise.id]))
+        url = reverse('download', args=['wirelog', cruise.id])
+        fmt = request.POST.get('format', 'csv')
+        return HttpResponseRedirect(url if fmt == 'csv' else '{}?format={}'.format(url, fmt))
 
+
+def eventlog_data(request):
+    try:
+        cruise = Cruise.get_active_cruise()
+    except ValueError:
+        cruise = None
+    if not cruise:
+        return JsonResponse(utils.get_datatable_response(request, 0, 0, []))
+    log = ShipLog.get_log(cruise)
+    total = filtered = log.count()
+    if request.GET.get('device') or request.GET.get('event'):
+        if request.GET.get('device'):
+            log = log.filter(device_id=utils.get_int(request.GET, 'device'))
+        if request.GET.get('event'):
+            log = log.filter(event_id=utils.get_int(request.GET, 'event'))
+        filtered = log.count()
+    columns = ['timestamp', 'timestamp', 'event__name', 'device__name', 'gps__latitude', 'gps__longitude']
+    page = utils.get_datatable_page(request, log, columns)
+    fields = ['timestamp', 'event__name', 'device__name', 'gps__latitude_degree', 'gps__latitude_minute', 'gps__longitude_degree', 'gps__longitude_minute']
+    rows = [[
+        date(timestamp, 'Y-m-d H:i:s'),
+        date(timestamp, 'T'),
+        escape(event),  # DataTables inserts cells as HTML
+        escape(device),
+        "{}°{}'".format(latitude_degree, latitude_minute),
+        "{}°{}'".format(longitude_degree, longitude_minute),
+    ] for timestamp, event, device, latitude_degree, latitude_minute, longitude_degree, longitude_minute in page.values_list(*fields)]
+    return JsonResponse(utils.get_datatable_response(request, total, filtered, rows))
+
+def wirelog_data(request):
+    cruise = Cruise.get_active_cruise()
+    if not cruise:
+        return JsonResponse(utils.get_datatable_response(request, 0, 0, []))
+    log = CastReport.get_log(cruise)
+    total = filtered = log.count()
+    if request.GET.get('device'):
+        log = log.filter(cast__recovery__device_id=utils.get_int(request.GET, 'device'))
+        filtered = log.count()
+    columns = ['cast__deployment__timestamp', 'cast__recovery__timestamp', 'cast__recovery__device__name', 'max_tension', 'max_speed', 'max_payout', 'cast__config__wire__serial_number', 'cast__config__winch']
+    page = utils.get_datatable_page(request, log, columns)
+    rows = [[
+        date(deployed, 'm/d/Y H:i:s'),
+        date(recovered, 'm/d/Y H:i:s'),
+        format_html('<a href="{}">{}</a>', reverse('cast', args=[cast_report_id]), device),
+        max_tension,
+        max_speed,
+        max_payout,
+        escape(wire) if wire is not None else None,
+        winch,
+    ] for cast_report_id, deployed, recovered, device, max_tension, max_speed, max_payout, wire, winch in page.values_list('id', *columns)]
+    return JsonResponse(utils.get_datatable_response(request, total, filtered, rows))
+
+def cast(request, cast_report_id):
+    cast_report = get_object_or_404(CastReport.objects.select_related('cast__deployment', 'cast__recovery__device', 'cast__config__wire'), pk=cast_report_id)
+    return render(request, 'cast.html', {'cast_report': cast_report, 'width': settings.CAST_PROFILE_WIDTH})
+
+def cast_profile(request, cast_report_id):
+    cast_report = get_object_or_404(CastReport.objects.select_related('cast__deployment', 'cast__recovery', 'cast__config'), pk=cast_report_id)
+    width = min(max(utils.get_int(request.GET, 'width', settings.CAST_PROFILE_WIDTH), 1), settings.CAST_PROFILE_MAX_WIDTH)
+    return JsonResponse(cast_report.get_profile(width))
+
+@csrf_exempt  # checked below for browser sessions, the instrument bridge sends a token instead
+@require_POST
+def import_events(request):
+    """Log a batch of events for the active cruise from an uploaded CSV file, a CSV body or a JSON list"""
+    token = settings.IMPORT_TOKEN
+    if token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Token {}'.format(token)):
+        pass
+    elif request.user.is_active and request.user.is_staff:
+        rejected = CsrfViewMiddleware().process_view(request, None, (), {})
+        if rejected is not None:
+            return rejected
+    else:
+        return JsonResponse({'imported': 0, 'duplicates': 0, 'errors': ['Staff login or import token required']}, status=403)
+    cruise = Cruise.get_active_cruise()
+    if not cruise:
+        return JsonResponse({'imported': 0, 'duplicates': 0, 'errors': ['Not cruising']}, status=400)
+    upload = request.FILES.get('file')
+    try:
+        if upload is not None:
+            df = utils.read_import(upload)
+        else:
+            df = utils.read_import(request.body, request.content_type)
+    except ValueError as e:
+        return JsonResponse({'imported': 0, 'duplicates': 0, 'errors': ['Unreadable import: {}'.format(e)]}, status=400)
+    result = ShipLog.import_events(cruise, df)
+    return JsonResponse({'imported': len(result.shiplogs), 'duplicates': result.duplicates, 'errors': result.errors}, status=400 if result.errors else 200)
@@ -0,0 +1,408 @@
+import io
+import os
+import ntpath
+import hashlib
+import tempfile
+from glob import glob
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+FILENAME_FORMAT = '%Y-%m-%d %H-%M-%S WinchDAC.csv'
+CLOCK_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+HEADER_LINES = 10  # 8 lines of LCI-90i metadata, column names, units
+CHANNELS = ['Tension', 'Speed', 'Payout']
+WINCHES = [1, 2, 3]
+ROLLUP_RESOLUTIONS = [1, 10, 60]  # seconds per rollup bucket
+TAIL_BYTES = 256  # bytes before a cached offset that must be unchanged for the file to count as appended to
+
+def winch_columns(winch_number):
+    return ['{}{}'.format(channel, winch_number) for channel in CHANNELS]
+
+COLUMNS = ['Seconds', 'Date'] + [c for w in WINCHES for c in winch_columns(w)]
+
+def naive_utc(timestamp):
+    """The winch clock is logged in UTC, without a timezone, to the second"""
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tz is not None:
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+    return timestamp.floor('S')
+
+def files_between(start_date, end_date):
+    """Daily winch files whose date falls between start_date and end_date, oldest first"""
+    winch_files = []
+    paths = sorted(f for f in glob(settings.WINCH_DATAFILE_PATH) if os.path.isfile(f))
+    for f in paths:
+        winch_file = WinchFile(f, is_current=f == paths[-1])
+        if start_date <= winch_file.date and winch_file.date <= end_date:
+            winch_files.append(winch_file)
+    return winch_files
+
+def iter_frame(df, start, end, winch_number, chunksize=None):
+    """Chunks of one winch logged between start and end out of an already loaded file"""
+    chunksize = chunksize or settings.WINCH_CHUNK_ROWS
+    start, end = naive_utc(start).to_datetime64(), naive_utc(end).to_datetime64()
+    df = df[['Date'] + winch_columns(winch_number)]
+    dates = df['Date'].values
+    if (dates[:-1] <= dates[1:]).all():
+        df = df.iloc[np.searchsorted(dates, start):np.searchsorted(dates, end, side='right')]
+    for i in range(0, len(df), chunksize):
+        chunk = df.iloc[i:i + chunksize]
+        chunk = chunk[(start <= chunk['Date'].values) & (chunk['Date'].values <= end)]
+        if not chunk.empty:
+            chunk.columns = ['Date'] + CHANNELS
+            yield chunk
+
+def rollup(df, resolution):
+    """Min, max and mean of each channel of one winch per bucket of resolution seconds"""
+    buckets = df.groupby(df['Date'].dt.floor('{}S'.format(resolution)))
+    stats = buckets[CHANNELS].agg(['min', 'max', 'mean'])
+    stats.columns = ['{}_{}'.format(channel.lower(), stat) for channel, stat in stats.columns]
+    stats['samples'] = buckets.size()
+    stats['tension_samples'] = buckets['Tension'].count()  # the mean tension of a bucket is over its samples that have one
+    return stats
+
+def decimate(df, width):
+    """Keep the first, last, min and max sample of each channel in each of width time buckets so peaks survive"""
+    if len(df) <= 4 * width:
+        return df.reset_index(drop=True)
+    df = df.reset_index(drop=True)
+    times = df['Date'].values.astype(np.int64)
+    # in floats, nanoseconds times a wide plot overflow int64 within a month
+    buckets = ((times - times[0]) / (times[-1] - times[0] + 1) * width).astype(np.int64)
+    keep = [df.groupby(buckets).head(1).index, df.groupby(buckets).tail(1).index]
+    for channel in CHANNELS:
+        values = df[channel].dropna()
+        grouped = values.groupby(buckets[values.index])
+        keep += [grouped.idxmin().values, grouped.idxmax().values]
+    return df.loc[np.unique(np.concatenate(keep))]
+
+class WinchFile(object):
+    """A daily WinchDAC file with its parsed columns cached on disk, keyed by path, size and mtime"""
+
+    def __init__(self, path, is_current=False):
+        self.path = path
+        self.is_current = is_current  # the newest file is the one the logger is still appending to
+        self.date = datetime.strptime(ntpath.basename(path), FILENAME_FORMAT).date()
+
+    @property
+    def cache_path(self):
+        key = hashlib.sha1(self.path.encode()).hexdigest()
+        return os.path.join(settings.WINCH_CACHE_PATH, key + '.npz')
+
+    @property
+    def index_path(self):
+        return self.cache_path.replace('.npz', '.idx.npz')
+
+    def load(self):
+        """All winches of this file, parsing only what was appended since the cache was written"""
+        stat = os.stat(self.path)
+        df, size, mtime, offset, tail = self._read_cache()
+        if df is not None and size == stat.st_size and mtime == stat.st_mtime_ns:
+            return df
+        if df is None or stat.st_size < offset or self._tail(offset) != tail:
+            df, offset = None, 0  # never parsed, or the file was rewritten
+        body, end, data_start = self._read_lines(offset, stat.st_size)
+        new_rows = self._parse(body[data_start - offset:])
+        df = new_rows if df is None else pd.concat([df, new_rows], ignore_index=True)
+        self._write_npz(self.cache_path, [stat.st_size, stat.st_mtime_ns, end, self._tail(end)], **{c: df[c].values for c in COLUMNS})
+        return df
+
+    def iter_range(self, start, end, winch_number, chunksize=None):
+        """Chunks of one winch logged between start and end, seeking to them through the time index"""
+        columns = ['Date'] + winch_columns(winch_number)
+        if not self.is_current:
+            # a closed day is parsed once and then served from the cache
+            for df in iter_frame(self._load_columns(columns), start, end, winch_number, chunksize):
+                yield df
+            return
+        chunksize = chunksize or settings.WINCH_CHUNK_ROWS
+        start, end = naive_utc(start).to_datetime64(), naive_utc(end).to_datetime64()
+        lo, hi = self.offsets_between(start, end)
+        for df in self._parse_window(lo, hi, columns, chunksize):
+            df = df[(start <= df['Date'].values) & (df['Date'].values <= end)]
+            if not df.empty:
+                df.columns = ['Date'] + CHANNELS
+                yield df
+
+    def offsets_between(self, start, end):
+        """Byte range that holds every row logged between start and end, the whole file if the clock ever stepped back"""
+        times, offsets, data_start, data_end = self.index()
+        lo, hi = data_start, data_end
+        if len(times) and not (np.diff(times.astype(np.int64)) < 0).any():
+            i = np.searchsorted(times, start, side='left') - 1
+            j = np.searchsorted(times, end, side='right')
+            lo = offsets[i] if i >= 0 else data_start
+            hi = offsets[j] if j < len(offsets) else data_end
+        return int(lo), int(hi)
+
+    def read_from(self, offset):
+        """All winches of the complete rows written after offset and the offset to continue from"""
+        size = os.stat(self.path).st_size
+        if size < offset:
+            offset = 0  # the file was rewritten
+        body, end, data_start = self._read_lines(offset, size)
+        return self._parse(body[data_start - offset:]), end
+
+    def index(self):
+        """Sparse time to byte offset index with a sample every WINCH_INDEX_INTERVAL rows, extended as the file grows"""
+        stat = os.stat(self.path)
+        try:
+            with np.load(self.index_path) as idx:
+                times, offsets = idx['times'], idx['offsets']
+                size, mtime, data_end, data_start, countdown, tail = idx['meta']
+        except (OSError, KeyError, ValueError):
+            size = None
+        if size is None or stat.st_size < data_end or self._tail(data_end) != tail:
+            times, offsets = np.array([], dtype='datetime64[ns]'), np.array([], dtype=np.int64)
+            data_end, data_start, countdown = 0, 0, 0
+        elif size == stat.st_size and mtime == stat.st_mtime_ns:
+            return times, offsets, data_start, data_end
+        body, end, start = self._read_lines(data_end, stat.st_size)
+        data_start = data_start or start
+        body = body[start - data_end:]
+        if body:
+            line_starts = np.r_[0, np.flatnonzero(np.frombuffer(body, dtype=np.uint8) == ord('\n'))[:-1] + 1]
+            sampled = line_starts[countdown::settings.WINCH_INDEX_INTERVAL]
+            countdown = (countdown - len(line_starts)) % settings.WINCH_INDEX_INTERVAL
+            clocks = [(body[s:body.index(b'\n', s)].split(b',', 2) + [b''])[1].decode() for s in sampled]
+            times = np.r_[times, pd.to_datetime(clocks, format=CLOCK_FORMAT, errors='coerce').values]
+            offsets = np.r_[offsets, sampled + start]
+            keep = ~np.isnat(times)
+            times, offsets = times[keep], offsets[keep]
+        self._write_npz(self.index_path, [stat.st_size, stat.st_mtime_ns, end, data_start, countdown, self._tail(end)], times=times, offsets=offsets)
+        return times, offsets, data_start, end
+
+    def _read_lines(self, offset, size):
+        """Complete lines from offset on, the offset just past them and the offset where data rows start"""
+        data = self._read_bytes(offset, size)
+        end = data.rfind(b'\n') + 1  # the logger may be part way through a line
+        data_start = offset
+        if offset == 0:
+            if data.count(b'\n', 0, end) < HEADER_LINES:
+                return b'', 0, 0  # the header is still being written
+            data_start = len(b'\n'.join(data.split(b'\n', HEADER_LINES)[:HEADER_LINES])) + 1
+        return data[:end], offset + end, data_start
+
+    def _load_columns(self, columns):
+        """Only the requested columns of a fresh cache, each column is a separate array in the .npz"""
+        stat = os.stat(self.path)
+        try:
+            with np.load(self.cache_path) as cache:
+                size, mtime = cache['meta'][:2]
+                if size == stat.st_size and mtime == stat.st_mtime_ns:
+                    return pd.DataFrame({c: cache[c] for c in columns})
+        except (OSError, KeyError, ValueError):
+            pass
+        return self.load()[columns]
+
+    def _parse_window(self, offset, size, columns, chunksize):
+        if size <= offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            window = io.BufferedReader(_Window(f, size - offset))
+            for df in pd.read_csv(window, header=None, usecols=[COLUMNS.index(c) for c in columns], chunksize=chunksize):
+                yield self._convert(df, columns)
+
+    def _read_bytes(self, offset, size):
+        """Private snapshot of the file up to the size it had when it was stat'ed, the logger may keep appending"""
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(max(size - offset, 0))
+
+    def _parse(self, data, columns=COLUMNS):
+        if not data.strip():
+            return pd.DataFrame({c: pd.Series(dtype='datetime64[ns]' if c == 'Date' else float) for c in columns})
+        df = pd.read_csv(io.BytesIO(data), header=None, usecols=[COLUMNS.index(c) for c in columns])
+        return self._convert(df, columns)
+
+    def _convert(self, df, columns):
+        df.columns = columns
+        for column in columns:
+            if column == 'Date':
+                df[column] = pd.to_datetime(df[column], format=CLOCK_FORMAT)
+            else:
+                df[column] = pd.to_numeric(df[column], errors='coerce')
+        return df
+
+    def _read_cache(self):
+        try:
+            with np.load(self.cache_path) as cache:
+                df = pd.DataFrame({c: cache[c] for c in COLUMNS})
+                size, mtime, offset, tail = cache['meta']
+        except (OSError, KeyError, ValueError):
+            return None, None, None, 0, None
+        return df, size, mtime, offset, tail
+
+    def _tail(self, offset):
+        """Fingerprint of the TAIL_BYTES before offset, a file rewritten since offset was cached no longer matches it"""
+        data = self._read_bytes(max(offset - TAIL_BYTES, 0), offset)
+        return int.from_bytes(hashlib.sha1(data).digest()[:8], 'little', signed=True)
+
+    def _write_npz(self, path, meta, **arrays):
+        os.makedirs(settings.WINCH_CACHE_PATH, exist_ok=True)
+        # write then rename so concurrent workers never see a half written file
+        with tempfile.NamedTemporaryFile(dir=settings.WINCH_CACHE_PATH, suffix='.tmp', delete=False) as f:
+            np.savez(f, meta=np.array(meta, dtype=np.int64), **arrays)
+        os.replace(f.name, path)
+
+class _Window(io.RawIOBase):
+    """Read at most size bytes from the current position of f"""
+
+    def __init__(self, f, size):
+        self.f = f
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.f.read(min(len(b), self.remaining))
+        b[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+class CastStats(object):
+    """Running statistics of a cast, updated one chunk at a time"""
+
+    def __init__(self, tension_threshold=None):
+        self.tension_threshold = tension_threshold
+        self.max_tension = None
+        self.max_payout = None
+        self.max_speed = None
+        self.tension_sum = 0.0
+        self.tension_count = 0
+        self.seconds_above_threshold = 0.0
+        self.first_time = None
+        self.last_time = None
+        self._last_tension = np.nan
+
+    def update(self, df):
+        times = df['Date'].values
+        tension = df['Tension'].values.astype(float)
+        self.max_tension = self._max(self.max_tension, tension)
+        self.max_payout = self._max(self.max_payout, df['Payout'].values.astype(float))
+        self.max_speed = self._max(self.max_speed, df['Speed'].values.astype(float))
+        self.tension_sum += np.nansum(tension)
+        self.tension_count += np.count_nonzero(~np.isnan(tension))
+        if not len(times):
+            return
+        if self.last_time is not None:
+            # carry the last sample of the previous chunk so no interval is lost between chunks
+            times, tension = np.r_[self.last_time, times], np.r_[self._last_tension, tension]
+        if self.tension_threshold is not None:
+            seconds = np.diff(times) / np.timedelta64(1, 's')
+            self.seconds_above_threshold += float(seconds[tension[:-1] > self.tension_threshold].sum())
+        self.first_time = times[0] if self.first_time is None else self.first_time
+        self.last_time = times[-1]
+        self._last_tension = tension[-1]
+
+    def _max(self, current, values):
+        if np.isnan(values).all():
+            return current
+        value = float(np.nanmax(values))
+        return value if current is None or value > current else current
+
+    @property
+    def mean_tension(self):
+        return self.tension_sum / self.tension_count if self.tension_count else None
+
+    @property
+    def duration(self):
+        if self.first_time is None:
+            return None
+        return pd.Timedelta(self.last_time - self.first_time).to_pytimedelta()
+
+class Rainflow(object):
+    """Rainflow count (ASTM E1049) of a series fed one chunk at a time, the reversals are found a chunk at once"""
+
+    def __init__(self, min_range=0.0, exponent=3.0):
+        self.min_range = min_range
+        self.exponent = exponent
+        self.cycles = 0.0
+        self.damage = 0.0  # sum of count * range ** exponent, Miner's rule on a Basquin S-N curve
+        self._stack = []  # reversals whose cycles are not closed yet
+        self._tail = np.empty(0)  # the last reversal and the last point, which may turn out to be a reversal
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        points = np.r_[self._tail, values[~np.isnan(values)]]
+        points = points[np.r_[True, np.diff(points) != 0]] if len(points) else points
+        if not len(points):
+            return
+        if not self._stack:
+            self._push(points[0])  # the first sample starts the series
+        slope = np.sign(np.diff(points))
+        turns = np.flatnonzero(slope[1:] != slope[:-1]) + 1
+        for value in points[turns]:
+            self._push(value)
+        self._tail = points[[turns[-1] if len(turns) else 0, -1]]
+
+    def close(self):
+        """Count the end of the series and the reversals left open as half cycles"""
+        if len(self._tail) and self._tail[-1] != self._stack[-1]:
+            self._push(self._tail[-1])
+        for first, second in zip(self._stack, self._stack[1:]):
+            self._count(abs(second - first), 0.5)
+        self._stack = []
+        self._tail = np.empty(0)
+
+    def _push(self, value):
+        stack = self._stack
+        stack.append(value)
+        while len(stack) >= 3:
+            latest = abs(stack[-1] - stack[-2])
+            previous = abs(stack[-2] - stack[-3])
+            if latest < previous:
+                break
+            if len(stack) == 3:
+                self._count(previous, 0.5)  # the range starts the series, half a cycle
+                stack.pop(0)
+            else:
+                self._count(previous, 1.0)
+                del stack[-3:-1]
+
+    def _count(self, value, count):
+        if value >= self.min_range:
+            self.cycles += count
+            self.damage += count * value ** self.exponent
+
+class UsageStats(object):
+    """Wire paid out and in, tension cycles and time above tension thresholds of a cast, updated one chunk at a time"""
+
+    def __init__(self, tension_thresholds=(), min_range=0.0, exponent=3.0):
+        self.tension_thresholds = list(tension_thresholds)
+        self.rainflow = Rainflow(min_range, exponent)
+        self.samples = 0
+        self.seconds = 0.0
+        self.meters_out = 0.0
+        self.meters_in = 0.0
+        self.seconds_above = [0.0] * len(self.tension_thresholds)
+        self._last = None  # time, tension and payout of the last sample of the previous chunk
+
+    def update(self, df):
+        times = df['Date'].values
+        tension = df['Tension'].values.astype(float)
+        payout = df['Payout'].values.astype(float)
+        self.rainflow.update(tension)
+        self.samples += len(times)
+        if not len(times):
+            return
+        if self._last is not None:
+            # carry the last sample of the previous chunk so no interval is lost between chunks
+            times, tension, payout = np.r_[self._last[0], times], np.r_[self._last[1], tension], np.r_[self._last[2], payout]
+        seconds = np.diff(times) / np.timedelta64(1, 's')
+        self.seconds += float(seconds.sum())
+        paid = np.diff(payout[~np.isnan(payout)])
+        self.meters_out += float(paid[paid > 0].sum())
+        self.meters_in -= float(paid[paid < 0].sum())
+        for i, threshold in enumerate(self.tension_thresholds):
+            self.seconds_above[i] += float(seconds[tension[:-1] > threshold].sum())
+        last_payout = payout[~np.isnan(payout)]
+        self._last = (times[-1], tension[-1], last_payout[-1] if len(last_payout) else np.nan)
+
+    def close(self):
+        self.rainflow.close()
+        return self
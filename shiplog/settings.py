@@ -26,11 +26,12 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'eventcapture',
+    'eventcapture.apps.EventcaptureConfig',
     'celery',
 ]
 
 MIDDLEWARE = [
+    'eventcapture.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,6 +81,17 @@ DATABASES = {
     },
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'metrics': {
+        # on disk so the web server and the Celery workers share their timings
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'data', 'metrics'),
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -126,12 +138,41 @@ MEDIA_ROOT = os.path.join(PROJECT_PATH, 'media')
 MEDIA_URL = '/media/'
 
 # User settings
+ACTIVE_CRUISE_TIMEOUT = 60  # seconds other processes may take to notice a cruise was started or ended in admin
+DEVICE_TREE_TIMEOUT = 300  # seconds other processes may take to notice a device was changed in admin
 EVENT_LOG_FILENAME = '{}_EventLog.csv'
 WIRE_LOG_FILENAME = '{}_WireLog.csv'
 WIRE_REPORT_FILENAME = '{}_WireReport.csv'
+EXPORT_CHUNK_ROWS = 2000  # rows formatted at a time when streaming a log download
+EXPORT_CACHE_PATH = os.path.join(PROJECT_PATH, 'data', 'exports')
+ARCHIVE_CRUISES = False  # snapshot a cruise into ARCHIVE_PATH when it is ended in admin, needs pyarrow
+ARCHIVE_PATH = os.path.join(PROJECT_PATH, 'data', 'archive')
+ARCHIVE_COMPRESSION = 'zstd'
+IMPORT_TOKEN = None  # sent by the instrument bridge as 'Authorization: Token <IMPORT_TOKEN>' to import events, staff can import when logged in
+DATATABLE_PAGE_LENGTH = 100  # most rows the event and wire log tables ask for at once
+CAST_PROFILE_WIDTH = 800  # default plot width in pixels of the cast detail page
+CAST_PROFILE_MAX_WIDTH = 4000
+CAST_PROFILE_TIMEOUT = 60 * 60 * 24  # seconds a decimated cast profile is cached
+METRICS_CACHE = 'metrics'
+METRICS_BUFFER_SIZE = 5000  # most recent timings kept per process
+METRICS_FLUSH_INTERVAL = 10  # seconds between copies of a process' timings to the metrics cache
+METRICS_TIMEOUT = 60 * 60 * 24  # the timings of a process that stopped are dropped after this
 GPS_FILENAME = '/mnt/gps/MainMetMast_Nav.dat'
+GPS_ARCHIVE_PATH = '/mnt/gps/archive/*Nav*.dat'  # rotated nav files, read by backfill_gps
+GPS_RETRY_DELAY = 10  # seconds to wait for the nav file to catch up with an event
+GPS_MAX_RETRIES = 30
 WINCH_DATAFILE_PATH = '/mnt/winch/*WinchDAC.csv'
-WINCH_FILE_COPY = os.path.join(PROJECT_PATH, 'data', 'WinchDAV.csv')
+WINCH_CACHE_PATH = os.path.join(PROJECT_PATH, 'data', 'winch')
+WINCH_INDEX_INTERVAL = 60  # rows between time index samples, the winches are logged at 1 Hz
+WINCH_CHUNK_ROWS = 3600  # rows held in memory at once while computing cast statistics
+WINCH_INGEST_INTERVAL = 5  # seconds between polls of the current winch file by ingest_winch
+WINCH_SAMPLE_RETENTION_DAYS = 90  # 1 s winch rollups older than this are pruned, the 10 s and 1 min rollups are kept
+WINCH_ROLLUP_MIN_COVERAGE = 0.99  # share of a cast's seconds that need a 1 s rollup before the rollups are trusted over the winch files
+WINCH_ROLLUP_RETRY_DELAY = 10  # seconds a freshly recovered cast waits for ingest_winch to roll up its end
+WINCH_ROLLUP_MAX_RETRIES = 6  # then the cast is analyzed from the winch files
+WIRE_TENSION_THRESHOLDS = [2000, 4000, 6000]  # lbs, the time each cast spends above each is accounted
+WIRE_CYCLE_MIN_RANGE = 200  # lbs, smaller tension cycles are sensor noise and are not counted
+WIRE_SN_EXPONENT = 3  # slope of the S-N curve the relative fatigue damage is summed on
 WINCH_CHOICES = (
     (0, 'No winch'),
     (1, '1'),
@@ -142,3 +183,14 @@ WINCH_CHOICES = (
 # async settings
 ASYNC=True
 CELERY_BROKER_URL = 'amqp://localhost'
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1  # casts are long running, hand them out one at a time
+CELERY_BEAT_SCHEDULE = {
+    'sweep-gps': {
+        'task': 'eventcapture.models.sweep_gps',
+        'schedule': 300.0,  # fill in events still at 0°0' every 5 minutes
+    },
+    'cleanup-gps': {
+        'task': 'eventcapture.models.cleanup_gps',
+        'schedule': 60 * 60 * 24,  # drop the fixes no event points at once a day
+    },
+}
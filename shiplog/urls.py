@@ -2,8 +2,10 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
+from eventcapture.admin import performance_view
 
 urlpatterns = [
+    path('admin/performance/', admin.site.admin_view(performance_view), name='performance'),
     path('admin/', admin.site.urls),
     path('', include('eventcapture.urls')),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,50 @@
+function drawProfile(canvas, profile) {
+    // one panel per channel stacked on a shared time axis
+    var channels = [['tension', 'Tension (lbs)', '#d9534f'], ['speed', 'Speed (m/min)', '#5cb85c'], ['payout', 'Payout (m)', '#0275d8']];
+    var context = canvas.getContext('2d');
+    var panel = canvas.height / channels.length;
+    var first = profile.time[0], last = profile.time[profile.time.length - 1];
+    context.clearRect(0, 0, canvas.width, canvas.height);
+    context.font = '14px sans-serif';
+    channels.forEach(function(channel, i) {
+        var values = profile[channel[0]].filter(function(v) { return v !== null; });
+        var low = Math.min.apply(null, values), high = Math.max.apply(null, values);
+        var top = i * panel + 20, height = panel - 30;
+        context.fillStyle = channel[2];
+        context.fillText(channel[1] + ' ' + low + ' to ' + high, 5, top - 5);
+        context.strokeStyle = channel[2];
+        context.beginPath();
+        var drawing = false;
+        profile.time.forEach(function(t, j) {
+            var v = profile[channel[0]][j];
+            if (v === null) {
+                drawing = false;
+                return;
+            }
+            var x = (t - first) / ((last - first) || 1) * canvas.width;
+            var y = top + height - (v - low) / ((high - low) || 1) * height;
+            if (drawing) {
+                context.lineTo(x, y);
+            } else {
+                context.moveTo(x, y);
+                drawing = true;
+            }
+        });
+        context.stroke();
+    });
+}
+
+$(document).ready(function() {
+    var canvas = document.getElementById('castProfile');
+    if (!canvas) {
+        return;
+    }
+    canvas.width = canvas.clientWidth;
+    fetch($(canvas).data('url') + '?' + $.param({width: canvas.width}), {credentials: 'same-origin'})
+        .then(function(response) { return response.json(); })
+        .then(function(profile) {
+            if (profile.time.length) {
+                drawProfile(canvas, profile);
+            }
+        });
+});
@@ -1,12 +1,33 @@
+function serverSide(table) {
+    // the slim jQuery build has no $.ajax, fetch each page of the log from the server instead
+    return function(data, callback, settings) {
+        var filters = new URLSearchParams(window.location.search);
+        ['device', 'event'].forEach(function(name) {
+            if (filters.get(name)) {
+                data[name] = filters.get(name);
+            }
+        });
+        fetch(table.data('url') + '?' + $.param(data), {credentials: 'same-origin'})
+            .then(function(response) { return response.json(); })
+            .then(callback);
+    };
+}
+
 $(document).ready(function() {
     $('#eventLog').dataTable( {
         "searching": false,
         "order": [[ 0, "desc" ]],
-	"pageLength": 100
+	"pageLength": 100,
+        "serverSide": true,
+        "ajax": serverSide($('#eventLog')),
+        "columnDefs": [{"targets": "_all", "defaultContent": ""}]
     } );
     $('#wireLog').dataTable( {
         "searching": false,
         "order": [[ 1, "desc" ]],
-	"pageLength": 100
+	"pageLength": 100,
+        "serverSide": true,
+        "ajax": serverSide($('#wireLog')),
+        "columnDefs": [{"targets": "_all", "defaultContent": ""}]
     } );
 } );